@@ -0,0 +1,168 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from vi.cache.cache import Cache
+
+
+class CacheTestCase(unittest.TestCase):
+    """ Every test gets a new cache file
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        Cache.PATH_TO_CACHE = os.path.join(self.directory, "cache.sqlite3")
+        Cache.VERSION_CHECKED = False
+        self.cache = Cache()
+
+    def tearDown(self):
+        Cache.connection(Cache.PATH_TO_CACHE).close()
+        del Cache._connections.byPath[Cache.PATH_TO_CACHE]
+        Cache.PATH_TO_CACHE = None
+        Cache.VERSION_CHECKED = False
+        shutil.rmtree(self.directory)
+
+
+class ConnectionTest(CacheTestCase):
+    def test_one_connection_per_thread(self):
+        self.assertIs(self.cache.con, Cache().con)
+        other = []
+
+        def connect():
+            con = Cache().con
+            other.append(con)
+            con.close()
+
+        thread = threading.Thread(target=connect)
+        thread.start()
+        thread.join()
+        self.assertIsNot(other[0], self.cache.con)
+
+    def test_wal_mode(self):
+        self.assertEqual(self.cache.con.execute("PRAGMA journal_mode").fetchone()[0], "wal")
+
+    def test_a_put_is_seen_by_other_threads(self):
+        self.cache.put_into_cache("key", u"value")
+        values = []
+
+        def read():
+            con = Cache.connection(Cache.PATH_TO_CACHE)
+            values.append(Cache().get_fromcache("key"))
+            con.close()
+
+        thread = threading.Thread(target=read)
+        thread.start()
+        thread.join()
+        self.assertEqual(values, [u"value"])
+
+
+class MemoryTest(CacheTestCase):
+    def test_second_read_is_served_from_memory(self):
+        self.cache.put_into_cache("key", u"value")
+        self.assertEqual(self.cache.get_fromcache("key"), u"value")
+        before = Cache.memory_stats()
+        self.cache.con.execute("DELETE FROM cache")  # only the memory has it now
+        self.assertEqual(self.cache.get_fromcache("key"), u"value")
+        self.assertEqual(Cache.memory_stats()["hits"], before["hits"] + 1)
+
+    def test_put_replaces_the_remembered_value(self):
+        self.cache.put_into_cache("key", u"old")
+        self.assertEqual(self.cache.get_fromcache("key"), u"old")
+        self.cache.put_into_cache("key", u"new")
+        self.assertEqual(self.cache.get_fromcache("key"), u"new")
+
+    def test_missing_keys_are_remembered(self):
+        self.assertIsNone(self.cache.get_fromcache("missing"))
+        before = Cache.memory_stats()
+        self.assertIsNone(self.cache.get_fromcache("missing"))
+        self.assertEqual(Cache.memory_stats()["misses"], before["misses"])
+
+    def test_big_values_are_not_kept(self):
+        value = u"x" * (Cache.MEMORY_CACHE_MAX_VALUE + 1)
+        self.cache.put_into_cache("map", value)
+        self.assertEqual(self.cache.get_fromcache("map"), value)
+        self.cache.con.execute("DELETE FROM cache")
+        self.assertIsNone(self.cache.get_fromcache("map"))
+
+    def test_outdated_values(self):
+        self.cache.put_into_cache("key", u"value", -10)
+        self.assertIsNone(self.cache.get_fromcache("key"))
+        self.assertEqual(self.cache.get_fromcache("key", True), u"value")
+
+
+class WriteBehindTest(CacheTestCase):
+    def setUp(self):
+        CacheTestCase.setUp(self)
+        self.settings = Cache.WRITE_BEHIND, Cache.WRITE_BEHIND_DELAY, Cache.WRITE_BEHIND_MAX
+        Cache.WRITE_BEHIND = True
+        Cache.WRITE_BEHIND_DELAY = 60  # the writer thread must not flush during the test
+
+    def tearDown(self):
+        Cache.flush()
+        Cache.WRITE_BEHIND, Cache.WRITE_BEHIND_DELAY, Cache.WRITE_BEHIND_MAX = self.settings
+        CacheTestCase.tearDown(self)
+
+    def stored(self, key):
+        rows = self.cache.con.execute("SELECT data FROM cache WHERE key = ?", (key,)).fetchall()
+        return rows[0][0] if rows else None
+
+    def test_read_before_the_flush(self):
+        self.cache.put_into_cache("key", u"value")
+        self.assertIsNone(self.stored("key"))
+        self.assertEqual(self.cache.get_fromcache("key"), u"value")
+        self.assertEqual(Cache().get_fromcache("key"), u"value")
+        Cache.flush()
+        self.assertEqual(self.stored("key"), u"value")
+
+    def test_puts_of_a_key_are_written_once(self):
+        self.cache.put_into_cache("key", u"first")
+        self.cache.put_into_cache("key", u"second")
+        self.assertEqual(len(Cache._pending), 1)
+        Cache.flush()
+        self.assertEqual(self.stored("key"), u"second")
+        self.assertEqual(len(Cache._pending), 0)
+
+    def test_a_full_queue_is_flushed_at_once(self):
+        Cache.WRITE_BEHIND_MAX = 3
+        for index in range(3):
+            self.cache.put_into_cache("key{0}".format(index), u"value")
+        self.assertEqual([self.stored("key{0}".format(index)) for index in range(3)], [u"value"] * 3)
+
+
+class SweepTest(CacheTestCase):
+    def setUp(self):
+        CacheTestCase.setUp(self)
+        self.maxSize = Cache.MAX_SIZE
+
+    def tearDown(self):
+        Cache.MAX_SIZE = self.maxSize
+        CacheTestCase.tearDown(self)
+
+    def keys(self):
+        return sorted(row[0] for row in self.cache.con.execute("SELECT key FROM cache"))
+
+    def test_long_outdated_rows_are_deleted(self):
+        self.cache.put_into_cache("old", u"value", -Cache.SWEEP_OUTDATED_AGE - 10)
+        self.cache.put_into_cache("outdated", u"value", -10)
+        self.cache.put_into_cache("fresh", u"value")
+        self.assertEqual(self.cache.sweep(), 1)
+        self.assertEqual(self.keys(), ["fresh", "outdated"])
+        self.assertIsNone(self.cache.get_fromcache("old", True))
+
+    def test_least_recently_read_rows_above_max_size(self):
+        for key in ("settings", "first", "second", "third"):
+            self.cache.put_into_cache(key, u"x" * 100)
+        for accessed, key in enumerate(("settings", "first", "second", "third")):
+            self.cache.con.execute("UPDATE cache SET accessed = ? WHERE key = ?", (accessed, key))
+        Cache.MAX_SIZE = 250
+        self.assertEqual(self.cache.sweep(), 2)
+        self.assertEqual(self.keys(), ["settings", "third"])
+
+    def test_incremental_vacuum(self):
+        self.assertEqual(self.cache.con.execute("PRAGMA auto_vacuum").fetchone()[0], 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
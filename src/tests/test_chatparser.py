@@ -0,0 +1,77 @@
+import datetime
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+try:
+    from vi.chatparser.chatparser import ChatParser, Message, MessageHistory
+except ImportError:  # vi.chatparser needs PyQt4
+    ChatParser = None
+
+
+def write_log(path, lines):
+    with io.open(path, "w", encoding="utf-16", newline="") as f:
+        f.write(u"".join(line + u"\n" for line in lines))
+
+
+@unittest.skipIf(ChatParser is None, "PyQt4 is not installed")
+class LogFilenameTest(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_backfill_takes_the_room_from_the_filename(self):
+        write_log(os.path.join(self.path, "North_Intel_20150124_190307.txt"), [u"header"])
+        write_log(os.path.join(self.path, "notes.txt"), [u"no chatlog"])
+        parser = ChatParser(self.path, ["North_Intel"], {})
+        self.assertEqual([result.roomname for result in parser.collect_backfill()], ["North_Intel"])
+
+    def test_file_modified_ignores_other_files(self):
+        path = os.path.join(self.path, "notes.txt")
+        write_log(path, [u"no chatlog"])
+        parser = ChatParser(self.path, ["notes"], {})
+        self.assertEqual(parser.file_modified(path), [])
+        self.assertNotIn(path, parser.fileData)
+
+
+@unittest.skipIf(ChatParser is None, "PyQt4 is not installed")
+class MessageHistoryTest(unittest.TestCase):
+    START = datetime.datetime(2015, 1, 24, 19, 0, 0)
+
+    def message(self, seconds, text, room="Intel"):
+        return Message(room, text, self.START + datetime.timedelta(seconds=seconds), "Pilot", set(), text.upper(), text)
+
+    def test_duplicates_are_found_by_their_content(self):
+        history = MessageHistory()
+        history.add(self.message(0, u"jita clear"))
+        self.assertIn(self.message(0, u"jita clear"), history)
+        self.assertNotIn(self.message(1, u"jita clear"), history)
+
+    def test_evicts_the_oldest_above_max_size(self):
+        history = MessageHistory(max_size=3)
+        for seconds in range(5):
+            history.add(self.message(seconds, u"text {0}".format(seconds)))
+        self.assertEqual([message.plainText for message in history], [u"text 2", u"text 3", u"text 4"])
+        self.assertNotIn(self.message(0, u"text 0"), history)
+
+    def test_evicts_messages_older_than_max_age(self):
+        history = MessageHistory(max_age=60)
+        history.add(self.message(0, u"old"))
+        history.add(self.message(30, u"recent"))
+        history.add(self.message(61, u"new"))
+        self.assertEqual([message.plainText for message in history], [u"recent", u"new"])
+
+    def test_last_in_room(self):
+        history = MessageHistory(room_size=2)
+        for seconds, room in enumerate(("Intel", "Other", "Intel", "Intel")):
+            history.add(self.message(seconds, u"text {0}".format(seconds), room))
+        self.assertEqual([message.plainText for message in history.last_in_room("Intel")], [u"text 3", u"text 2"])
+        self.assertEqual(list(history.last_in_room("Nowhere")), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
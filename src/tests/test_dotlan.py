@@ -0,0 +1,121 @@
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+from vi import dotlan
+from vi.cache.cache import Cache
+
+REGION = "Providencecatch"
+MAPDATA = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "vi", "ui", "res", "mapdata")
+
+
+def read_svg():
+    with open(os.path.join(MAPDATA, REGION + ".svg")) as f:
+        return f.read()
+
+
+class MapArtefactTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        Cache.PATH_TO_CACHE = os.path.join(self.directory, "cache.sqlite3")
+        Cache.VERSION_CHECKED = False
+
+    def tearDown(self):
+        Cache.connection(Cache.PATH_TO_CACHE).close()
+        del Cache._connections.byPath[Cache.PATH_TO_CACHE]
+        Cache.PATH_TO_CACHE = None
+        Cache.VERSION_CHECKED = False
+        shutil.rmtree(self.directory)
+
+    def test_second_load_uses_the_prepared_map(self):
+        svg = read_svg()
+        processed = dotlan.Map(REGION, svg)
+
+        def process_svg(self, svg):
+            raise AssertionError("the svg was processed again")
+
+        original = dotlan.Map._process_svg
+        dotlan.Map._process_svg = process_svg
+        try:
+            prepared = dotlan.Map(REGION, svg)
+        finally:
+            dotlan.Map._process_svg = original
+        self.assertEqual(sorted(prepared.systems), sorted(processed.systems))
+        for name, system in processed.systems.items():
+            self.assertEqual(sorted(neighbour.name for neighbour in prepared.systems[name].get_neighbours(2)),
+                             sorted(neighbour.name for neighbour in system.get_neighbours(2)))
+
+
+class Node(object):
+    """ The part of a dotlan.System JumpDistances uses
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._neighbours = set()
+
+
+def bfs_distances(source):
+    distances = {source: 0}
+    current = [source]
+    while current:
+        found = []
+        for node in current:
+            for neighbour in node._neighbours:
+                if neighbour not in distances:
+                    distances[neighbour] = distances[node] + 1
+                    found.append(neighbour)
+        current = found
+    return distances
+
+
+class JumpDistancesTest(unittest.TestCase):
+    def setUp(self):
+        self.nodes = [Node(index) for index in range(30)]
+        self.random = random.Random(42)
+        for index in range(1, len(self.nodes)):
+            # a tree, so removing a jump can cut the map in two
+            self.link(self.nodes[index], self.nodes[self.random.randrange(index)])
+        self.distances = dotlan.JumpDistances(self.nodes)
+
+    def link(self, first, second):
+        first._neighbours.add(second)
+        second._neighbours.add(first)
+
+    def unlink(self, first, second):
+        first._neighbours.discard(second)
+        second._neighbours.discard(first)
+
+    def assert_bfs_distances(self):
+        for start in self.nodes:
+            expected = bfs_distances(start)
+            for stop in self.nodes:
+                self.assertEqual(self.distances.distance(start, stop), expected.get(stop),
+                                 "{0} -> {1}".format(start.name, stop.name))
+
+    def test_distances(self):
+        self.assert_bfs_distances()
+        neighbours = self.distances.neighbours(self.nodes[0], 2)
+        self.assertEqual(set(neighbours), set(node for node, distance in bfs_distances(self.nodes[0]).items()
+                                              if distance <= 2))
+
+    def test_connect_and_disconnect(self):
+        jumps = []
+        for _ in range(20):
+            first, second = self.random.sample(self.nodes, 2)
+            if second in first._neighbours:
+                continue
+            self.link(first, second)
+            self.distances.connected(first, second)
+            jumps.append((first, second))
+            self.assert_bfs_distances()
+        for first, second in jumps + [(self.nodes[1], next(iter(self.nodes[1]._neighbours)))]:
+            self.unlink(first, second)
+            self.distances.disconnected(first, second)
+            self.assert_bfs_distances()
+
+
+if __name__ == "__main__":
+    unittest.main()
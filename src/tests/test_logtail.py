@@ -0,0 +1,47 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+try:
+    from vi.chatparser.logtail import LOG_ENCODING, LogTail
+except ImportError:  # vi.chatparser needs PyQt4
+    LogTail = None
+
+
+@unittest.skipIf(LogTail is None, "PyQt4 is not installed")
+class LogTailTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "Intel_20150124_190307.txt")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def append(self, data):
+        with open(self.path, "ab") as f:
+            f.write(data)
+
+    def test_line_split_across_two_reads(self):
+        data = u"first\nsec\xf6nd\n".encode(LOG_ENCODING)
+        split = data.index(u"\xf6".encode(LOG_ENCODING)) + 1  # in the middle of a code unit
+        tail = LogTail(self.path)
+        self.append(data[:split])
+        self.assertEqual(tail.read_lines(), [u"first"])
+        self.append(data[split:])
+        self.assertEqual(tail.read_lines(), [u"sec\xf6nd"])
+        self.assertEqual(tail.read_lines(), [])
+        self.assertEqual(tail.lines, 2)
+
+    def test_truncated_file_is_read_again(self):
+        tail = LogTail(self.path)
+        self.append(u"old line\n".encode(LOG_ENCODING))
+        self.assertEqual(tail.read_lines(), [u"old line"])
+        with open(self.path, "wb") as f:
+            f.write(u"new\n".encode(LOG_ENCODING))
+        self.assertEqual(tail.read_lines(), [u"new"])
+        self.assertEqual(tail.lines, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
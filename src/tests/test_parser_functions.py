@@ -0,0 +1,46 @@
+import unittest
+
+try:
+    from vi.chatparser.parser_functions import annotate
+    from vi.resolver import SystemNameResolver
+except ImportError:  # vi.chatparser needs PyQt4
+    annotate = None
+
+SHIP = u'<span style="color:#d95911;font-weight:bold"> {0}</span>'
+SYSTEM = u'<a href="mark_system/{0}" style="color:#CC8800;font-weight:bold">{1}</a>'
+
+
+@unittest.skipIf(annotate is None, "PyQt4 is not installed")
+class AnnotateTest(unittest.TestCase):
+    """ The expected html is what the BeautifulSoup rewrite loops made of the text
+    """
+
+    def setUp(self):
+        self.resolver = SystemNameResolver({u"JITA": object(), u"X-7OMU": object()})
+
+    def html(self, text):
+        return annotate(text, self.resolver, set())[0]
+
+    def test_entities(self):
+        self.assertEqual(self.html(u"tom &amp; jerry"), u"<rtext>tom &amp; jerry</rtext>")
+        self.assertEqual(self.html(u"a & b < c"), u"<rtext>a &amp; b &lt; c</rtext>")
+        self.assertEqual(self.html(u"http://a.b/?x=1&amp;y=2"),
+                         u'<rtext><a href="link/http://a.b/?x=1&amp;y=2" style="color:#28a5ed;font-weight:bold">'
+                         u'http://a.b/?x=1&amp;y=2</a></rtext>')
+
+    def test_adjacent_ships(self):
+        expected = u"<rtext>{0} {1} in {2}</rtext>".format(SHIP.format(u"Rifter"), SHIP.format(u"Sabre"),
+                                                            SYSTEM.format(u"X-7OMU", u"X-7OMU"))
+        self.assertEqual(self.html(u"Rifter Sabre in X-7OMU"), expected)
+        self.assertEqual(self.html(u"Rifter   Sabre in X-7OMU"), expected)
+        self.assertEqual(self.html(u"2xRifter Sabre"),
+                         u"<rtext>2x{0} {1}</rtext>".format(SHIP.format(u"Rifter"), SHIP.format(u"Sabre")))
+
+    def test_markup_is_text(self):
+        # The soup made <b> a tag, we show what was written
+        self.assertEqual(self.html(u"<b>bold</b> jita"),
+                         u"<rtext>&lt;b&gt;bold&lt;/b&gt; {0}</rtext>".format(SYSTEM.format(u"JITA", u"jita")))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,45 @@
+import unittest
+from collections import OrderedDict
+
+from vi.resolver import PrefixTrie, SystemNameResolver
+
+
+class PrefixTrieTest(unittest.TestCase):
+    def test_first_inserted_wins(self):
+        trie = PrefixTrie()
+        trie.insert("HED-GP", 1)
+        trie.insert("HE-V4V", 2)
+        self.assertEqual(trie.first("HE"), 1)
+        self.assertEqual(trie.first("HE-"), 2)
+        self.assertIsNone(trie.first("HX"))
+
+    def test_max_depth(self):
+        trie = PrefixTrie(2)
+        trie.insert("JITA", 1)
+        self.assertEqual(trie.first("JI"), 1)
+        self.assertIsNone(trie.first("JIT"))
+
+
+class SystemNameResolverTest(unittest.TestCase):
+    def setUp(self):
+        names = ("JITA", "HED-GP", "HE-V4V", "I43-IF3", "F-YH58")
+        self.resolver = SystemNameResolver(OrderedDict((name, object()) for name in names))
+
+    def test_direct_hit(self):
+        self.assertEqual(self.resolver.resolve("HE-V4V"), "HE-V4V")
+
+    def test_short_words_are_prefixes(self):
+        self.assertEqual(self.resolver.resolve("JIT"), "JITA")
+        self.assertEqual(self.resolver.resolve("HE"), "HED-GP")
+        self.assertIsNone(self.resolver.resolve("J"))
+
+    def test_dash_initials(self):
+        self.assertEqual(self.resolver.resolve("IX-IY"), "I43-IF3")
+
+    def test_prefix_without_the_dash(self):
+        self.assertEqual(self.resolver.resolve("FYH58"), "F-YH58")
+        self.assertIsNone(self.resolver.resolve("JITAX"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,40 @@
+import unittest
+
+from vi import states
+
+try:
+    from vi.chatparser.chatparser import ChatParser
+    from vi.chatparser.shipmatcher import ShipMatcher
+except ImportError:  # vi.chatparser needs PyQt4
+    ChatParser = None
+
+
+@unittest.skipIf(ChatParser is None, "PyQt4 is not installed")
+class ShipMatcherTest(unittest.TestCase):
+    def setUp(self):
+        self.matcher = ShipMatcher(["RIFTER", "RAVEN", "RAVEN NAVY ISSUE", "HERON", "ERON"])
+
+    def ships(self, upper_text):
+        return [upper_text[start:end] for start, end in self.matcher.find_ships(upper_text)]
+
+    def test_word_boundaries(self):
+        self.assertEqual(self.ships("RIFTER AND HERON"), ["RIFTER", "HERON"])
+        self.assertEqual(self.ships("2XRIFTER 3 RAVENS GATE"), ["RIFTER", "RAVEN"])
+        self.assertEqual(self.ships("RIFTERING SHERON"), [])
+
+    def test_longest_name_wins(self):
+        self.assertEqual(self.ships("RAVEN NAVY ISSUE ON GATE"), ["RAVEN NAVY ISSUE"])
+
+
+@unittest.skipIf(ChatParser is None, "PyQt4 is not installed")
+class ParseShipsTest(unittest.TestCase):
+    def test_line_with_a_ship_name(self):
+        parser = ChatParser("", ["Intel"], {})
+        message = parser._line_to_message(u"[ 2015.01.24 19:03:07 ] Pilot > 2xRifter and a Sabre", "Intel")
+        self.assertEqual(message.status, states.ALARM)
+        self.assertIn(u'<span style="color:#d95911;font-weight:bold"> Rifter</span>', message.message)
+        self.assertIn(u'<span style="color:#d95911;font-weight:bold"> Sabre</span>', message.message)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,25 @@
+import unittest
+
+from vi import svgdocument
+
+MALFORMED_SVG = u"""<svg xmlns="http://www.w3.org/2000/svg" width="100" height="100">
+    <g id="jumps"><line id="j-1-2" class="j" x1="0" y1="0" x2="1" y2="1"></g>
+    <symbol id="def1"><a class="sys link-5-1"><rect x="4" y="3.5"/><text>A-1 &nbsp;</text></a></symbol>
+</svg>"""
+
+
+class LoadDocumentTest(unittest.TestCase):
+    def test_malformed_svg_falls_back_to_the_soup(self):
+        document = svgdocument.load_document(MALFORMED_SVG)
+        self.assertEqual(document.name, svgdocument.SoupDocument.name)
+        self.assertIn("jumps", document.elements_by_id())
+        self.assertEqual(len(document.select(".sys")), 1)
+
+    @unittest.skipIf(svgdocument.etree is None, "lxml is not installed")
+    def test_well_formed_svg_uses_lxml(self):
+        document = svgdocument.load_document(u'<svg xmlns="http://www.w3.org/2000/svg"><g id="jumps"/></svg>')
+        self.assertEqual(document.name, svgdocument.EtreeDocument.name)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -22,7 +22,9 @@ from __future__ import print_function
 import os
 import sys
 
-from bs4 import BeautifulSoup
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from vi.svgdocument import load_document
 
 
 def check_arguments(args):
@@ -43,40 +45,40 @@ def concat(first_file, second_file):
     system_uses = []
 
     for def_element in second_svg.select("defs"):
-        for symbol in def_element.select("symbol"):
+        for symbol in second_svg.select("symbol", def_element):
             symbols.append(symbol)
 
     for jumpgroup in second_svg.select("#jumps"):
-        for jump in jumpgroup.select("line"):
-            jump["x1"] = float(jump["x1"]) + 3000
-            jump["x2"] = float(jump["x2"]) + 3000
+        for jump in second_svg.select("line", jumpgroup):
+            second_svg.set(jump, "x1", float(second_svg.get(jump, "x1")) + 3000)
+            second_svg.set(jump, "x2", float(second_svg.get(jump, "x2")) + 3000)
             jumps.append(jump)
 
     for sysgroup in second_svg.select("#sysuse"):
-        for sysuse in sysgroup.select("use"):
-            sysuse["x"] = float(sysuse["x"]) + 3000
+        for sysuse in second_svg.select("use", sysgroup):
+            second_svg.set(sysuse, "x", float(second_svg.get(sysuse, "x")) + 3000)
             system_uses.append(sysuse)
 
     def_element = first_svg.select("defs")[0]
     for symbol in symbols:
-        def_element.append(symbol)
+        first_svg.append(def_element, symbol)
 
     jumps_element = first_svg.select("#jumps")[0]
     for jump in jumps:
-        jumps_element.append(jump)
+        first_svg.append(jumps_element, jump)
 
     system_use_element = first_svg.select("#sysuse")[0]
     for systemUse in system_uses:
-        system_use_element.append(systemUse)
+        first_svg.append(system_use_element, systemUse)
 
     return first_svg
 
 
 def load_svg(path):
     content = None
-    with open(path) as f:
+    with open(path, "rb") as f:
         content = f.read()
-    return BeautifulSoup(content)
+    return load_document(content)
 
 
 def main():
@@ -88,7 +90,7 @@ def main():
         sys.exit(1)
     check_arguments(sys.argv)
     new_svg = concat(sys.argv[1], sys.argv[2])
-    result = new_svg.body.next.prettify().encode("utf-8")
+    result = new_svg.serialize(pretty=True).encode("utf-8")
     print(result)
 
 
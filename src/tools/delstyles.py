@@ -22,30 +22,28 @@ from __future__ import print_function
 import os
 import sys
 
-from bs4 import BeautifulSoup
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from vi.svgdocument import load_document
 
 
 def read_svg(path):
     if not os.path.exists(path):
         errout("ERROR: {0} does not exist!".format(path))
         sys.exit(2)
-    soup = None
-    with open(path) as f:
-        soup = BeautifulSoup(f.read())
-    return soup
-
+    document = None
+    with open(path, "rb") as f:
+        document = load_document(f.read())
+    return document
 
-def delete_styles_from_svg(soup):
-    def recursive_remove_style(element):
-        for subElement in element.select("*"):
-            if "style" in subElement.attrs:
-                del subElement.attrs["style"]
-            if subElement.name == "text":
-                subElement.attrs["text-anchor"] = "middle"
-            recursive_remove_style(subElement)
 
-    recursive_remove_style(soup)
-    return soup
+def delete_styles_from_svg(document):
+    # select returns all descendants, no need to recurse
+    for element in document.select("*"):
+        document.delete(element, "style")
+        if document.tag(element) == "text":
+            document.set(element, "text-anchor", "middle")
+    return document
 
 
 def main():
@@ -58,7 +56,7 @@ def main():
     path = sys.argv[1]
     source = read_svg(path)
     without_style = delete_styles_from_svg(source)
-    result = without_style.body.next.prettify().encode("utf-8")
+    result = without_style.serialize(pretty=True).encode("utf-8")
     print(result)
 
 
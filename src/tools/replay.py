@@ -0,0 +1,238 @@
+###########################################################################
+#  replay - Replay chatlogs and measure the intel latency						  #
+#  Copyright (C) 2014-15 Sebastian Meyer (sparrow.242.de+eve@gmail.com )  #
+#																		  #
+#  This program is free software: you can redistribute it and/or modify	  #
+#  it under the terms of the GNU General Public License as published by	  #
+#  the Free Software Foundation, either version 3 of the License, or	  #
+#  (at your option) any later version.									  #
+#																		  #
+#  This program is distributed in the hope that it will be useful,		  #
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of		  #
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.	 See the		  #
+#  GNU General Public License for more details.							  #
+#																		  #
+#																		  #
+#  You should have received a copy of the GNU General Public License	  #
+#  along with this program.	 If not, see <http://www.gnu.org/licenses/>.  #
+###########################################################################
+
+""" Writes synthetic or recorded intel into chatlogs (UTF-16, with the
+    header EVE writes) at a given rate and measures how long it takes
+    from writing a line to the parsed Message and to the changed map.
+    FileWatcher, ChatParser and dotlan.Map are the ones vintel uses.
+    Example (from the src directory):
+        python tools/replay.py --rate 20 --count 500 /tmp/replaylogs
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PyQt4 import QtCore
+from PyQt4.QtCore import SIGNAL
+
+from vi import dotlan, evegate, filewatcher, states
+from vi.cache.cache import Cache
+from vi.chatparser import ChatParser
+
+DEFAULT_MAP = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "vi", "ui", "res", "mapdata",
+                           "Providencecatch.svg")
+SYNTHETIC_TEXTS = (u"{system} {n} reds", u"{system} +{n} nv", u"{system} clr", u"{system} status?", u"{n}x Rifter {system}",
+                   u"{n} in {system}", u"{system} clear")
+LOCAL_EVERY = 50  # every n lines the character changes the system
+
+
+def log_header(roomname, listener, session_start):
+    lines = [u"\ufeff", u"", u"        ---------------------------------------------------------------", u"",
+             u"          Channel ID:      {0}".format(roomname.lower()), u"          Channel Name:    {0}".format(roomname),
+             u"          Listener:        {0}".format(listener),
+             u"          Session started: {0}".format(session_start.strftime("%Y.%m.%d %H:%M:%S")),
+             u"        ---------------------------------------------------------------", u"", u"", u""]
+    return lines
+
+
+def chat_line(username, text):
+    timestamp = evegate.current_eve_time().strftime("%Y.%m.%d %H:%M:%S")
+    return u"[ {0} ] {1} > {2}".format(timestamp, username, text)
+
+
+def create_log(directory, roomname, listener):
+    now = evegate.current_eve_time()
+    path = os.path.join(directory, u"{0}_{1}.txt".format(roomname, now.strftime("%Y%m%d_%H%M%S")))
+    append_lines(path, log_header(roomname, listener, now))
+    return path
+
+
+def append_lines(path, lines):
+    data = u"".join(line + u"\r\n" for line in lines)
+    with open(path, "ab") as f:
+        f.write(data.encode("utf-16-le"))
+
+
+def recorded_texts(path):
+    """ The (username, text) of all chat lines of a recorded chatlog
+    """
+    with open(path, "rb") as f:
+        content = f.read().decode("utf-16")
+    texts = []
+    for line in content.split(u"\n"):
+        line = line.strip()
+        time_ends = line.find("]")
+        user_ends = line.find(">", time_ends)
+        if line.startswith("[") and time_ends > 0 and user_ends > 0:
+            texts.append((line[time_ends + 1:user_ends].strip(), line[user_ends + 1:].strip()))
+    return texts
+
+
+def synthetic_texts(system_names, count):
+    texts = []
+    for index in range(count):
+        text = random.choice(SYNTHETIC_TEXTS).format(system=random.choice(system_names), n=random.randint(1, 20))
+        texts.append((u"Pilot {0}".format(index % 17), text))
+    return texts
+
+
+class Replay(object):
+    def __init__(self, args):
+        self.args = args
+        self.written = {}  # (username, text): [times the line was written]
+        self.parseLatencies = []
+        self.mapLatencies = []
+        self.pending = 0
+        self.writerDone = False
+        self.lock = threading.Lock()
+
+        Cache.PATH_TO_CACHE = os.path.join(tempfile.mkdtemp(), "replay-cache.sqlite3")
+        with open(args.map) as f:
+            self.map = dotlan.Map(os.path.basename(args.map)[:-4], f.read())
+        system_names = sorted(self.map.systems.keys())
+        if args.recorded:
+            self.texts = recorded_texts(args.recorded)[:args.count]
+        else:
+            self.texts = synthetic_texts(system_names, args.count)
+        self.systemNames = system_names
+
+        if not os.path.exists(args.directory):
+            os.makedirs(args.directory)
+        self.intelPath = create_log(args.directory, args.room, args.character)
+        self.localPath = create_log(args.directory, "Local", args.character)
+
+        self.parser = ChatParser(args.directory, [args.room], self.map.systems, self.map.systemResolver)
+        self.watcher = filewatcher.FileWatcher(args.directory)
+        QtCore.QObject.connect(self.watcher, SIGNAL("file_change"), self.file_changed)
+
+    def start(self):
+        self.watcher.paused = False
+        self.watcher.start()
+        writer = threading.Thread(target=self.write_lines)
+        writer.daemon = True
+        writer.start()
+
+    def write_lines(self):
+        interval = 1.0 / self.args.rate
+        next_write = time.time()
+        for index, (username, text) in enumerate(self.texts):
+            if index % LOCAL_EVERY == 0:
+                system = random.choice(self.systemNames)
+                line = chat_line(u"EVE System", u"Channel changed to Local : {0}".format(system))
+                append_lines(self.localPath, [line])
+            with self.lock:
+                self.written.setdefault((username, text), []).append(time.time())
+                self.pending += 1
+            append_lines(self.intelPath, [chat_line(username, text)])
+            next_write += interval
+            time.sleep(max(0, next_write - time.time()))
+        self.writerDone = True
+
+    def file_changed(self, path):
+        changed_systems = []
+        now = time.time()
+        for message in self.parser.file_modified(path):
+            with self.lock:
+                write_times = self.written.get((message.user, message.plainText))
+                if not write_times:
+                    continue
+                written = write_times.pop(0)
+                self.pending -= 1
+            self.parseLatencies.append(now - written)
+            if message.status != states.IGNORE and message.systems:
+                for system in message.systems:
+                    system.set_status(message.status)
+                changed_systems.append(written)
+        if changed_systems:
+            self.map.svg  # renders the map
+            now = time.time()
+            for written in changed_systems:
+                self.mapLatencies.append(now - written)
+
+    def finished(self):
+        return self.writerDone and self.pending <= 0
+
+    def report(self):
+        print("Lines written:   {0} at {1} lines/s".format(len(self.texts), self.args.rate))
+        print("Lines parsed:    {0}".format(len(self.parseLatencies)))
+        print_latencies("write -> Message", self.parseLatencies)
+        print_latencies("write -> map", self.mapLatencies)
+
+
+def print_latencies(title, latencies):
+    if not latencies:
+        print("{0:18}: no data".format(title))
+        return
+    values = sorted(latencies)
+    percentile = lambda p: values[min(len(values) - 1, int(len(values) * p))]
+    print("{0:18}: mean {1:7.1f} ms  median {2:7.1f} ms  p95 {3:7.1f} ms  max {4:7.1f} ms".format(
+        title, 1000 * sum(values) / len(values), 1000 * percentile(0.5), 1000 * percentile(0.95), 1000 * values[-1]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replays intel into chatlogs and measures the latency of vintel")
+    parser.add_argument("directory", help="where the chatlogs are written")
+    parser.add_argument("--rate", type=float, default=5.0, help="lines per second (default: 5)")
+    parser.add_argument("--count", type=int, default=200, help="number of intel lines (default: 200)")
+    parser.add_argument("--room", default=u"TheCitadel", help="name of the intel room (default: TheCitadel)")
+    parser.add_argument("--character", default=u"Replay Pilot", help="listener of the logs (default: Replay Pilot)")
+    parser.add_argument("--recorded", help="replay the chat lines of this chatlog instead of synthetic intel")
+    parser.add_argument("--map", default=DEFAULT_MAP, help="the region svg to use")
+    parser.add_argument("--timeout", type=float, default=10.0, help="seconds to wait for the last lines (default: 10)")
+    args = parser.parse_args()
+    if args.recorded and not os.path.exists(args.recorded):
+        errout("ERROR: {0} does not exist!".format(args.recorded))
+        sys.exit(2)
+
+    app = QtCore.QCoreApplication(sys.argv)
+    replay = Replay(args)
+    deadline = [None]
+
+    def check_finished():
+        if replay.writerDone and deadline[0] is None:
+            deadline[0] = time.time() + args.timeout
+        if replay.finished() or (deadline[0] and time.time() > deadline[0]):
+            timer.stop()
+            replay.watcher.quit()
+            replay.watcher.wait()
+            replay.report()
+            app.quit()
+
+    timer = QtCore.QTimer()
+    QtCore.QObject.connect(timer, SIGNAL("timeout()"), check_finished)
+    timer.start(100)
+    replay.start()
+    sys.exit(app.exec_())
+
+
+def errout(*objs):
+    print(*objs, file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
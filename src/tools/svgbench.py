@@ -0,0 +1,111 @@
+###########################################################################
+#  svgbench - Compare the svg backends on region maps					  #
+#  Copyright (C) 2014-15 Sebastian Meyer (sparrow.242.de+eve@gmail.com )  #
+#																		  #
+#  This program is free software: you can redistribute it and/or modify	  #
+#  it under the terms of the GNU General Public License as published by	  #
+#  the Free Software Foundation, either version 3 of the License, or	  #
+#  (at your option) any later version.									  #
+#																		  #
+#  This program is distributed in the hope that it will be useful,		  #
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of		  #
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.	 See the		  #
+#  GNU General Public License for more details.							  #
+#																		  #
+#																		  #
+#  You should have received a copy of the GNU General Public License	  #
+#  along with this program.	 If not, see <http://www.gnu.org/licenses/>.  #
+###########################################################################
+
+""" Compares the svg backends (lxml and BeautifulSoup) on region maps:
+    parsing the svg, creating the dotlan.Map from the svg and from the
+    prepared map in the cache, and rendering the map after a change.
+    Example (from the src directory):
+        python tools/svgbench.py --repeat 5 vi/ui/res/mapdata/Providencecatch.svg
+"""
+
+from __future__ import print_function
+
+import argparse
+import glob
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from vi import dotlan, states, svgdocument
+from vi.cache.cache import Cache
+
+MAPDATA = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "vi", "ui", "res", "mapdata")
+
+
+def best_of(repeat, function):
+    """ The fastest of repeat calls of function, in seconds
+    """
+    timings = []
+    for run in range(repeat):
+        start = time.time()
+        function(run)
+        timings.append(time.time() - start)
+    return min(timings)
+
+
+def benchmark(path, backend, repeat):
+    with open(path, "rb") as f:
+        svg = f.read()
+    region = os.path.splitext(os.path.basename(path))[0]
+    results = {"parse": best_of(repeat, lambda run: svgdocument.load_document(svg, backend))}
+    # Every run uses another region name, so there is no prepared map in the cache
+    results["process"] = best_of(repeat, lambda run: dotlan.Map("{0}_{1}_{2}".format(region, backend, run), svg, backend))
+    results["prepared"] = best_of(repeat, lambda run: dotlan.Map("{0}_{1}_0".format(region, backend), svg, backend))
+    region_map = dotlan.Map("{0}_{1}_0".format(region, backend), svg, backend)
+    systems = list(region_map.systems.values())
+
+    def render(run):
+        systems[run % len(systems)].set_status(states.ALARM)
+        return region_map.svg
+
+    results["render"] = best_of(repeat, render)
+    results["systems"] = len(systems)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compares the svg backends on region maps")
+    parser.add_argument("maps", nargs="*", help="region svgs (default: the bundled maps)")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per measurement, the fastest counts (default: 3)")
+    parser.add_argument("--backend", action="append", choices=sorted(svgdocument.BACKENDS),
+                        help="backend to measure, can be repeated (default: all available)")
+    args = parser.parse_args()
+    paths = args.maps or sorted(glob.glob(os.path.join(MAPDATA, "*.svg")))
+    backends = args.backend or sorted(svgdocument.BACKENDS)
+    for path in paths:
+        if not os.path.exists(path):
+            errout("ERROR: {0} does not exist!".format(path))
+            sys.exit(2)
+
+    # Keep the prepared maps of the benchmark out of vintel's cache
+    cache_file = tempfile.NamedTemporaryFile(suffix=".sqlite3", delete=False)
+    cache_file.close()
+    Cache.PATH_TO_CACHE = cache_file.name
+    try:
+        print("{0:24} {1:8} {2:>8} {3:>10} {4:>10} {5:>10} {6:>10}".format("map", "backend", "systems", "parse",
+                                                                           "process", "prepared", "render"))
+        for path in paths:
+            for backend in backends:
+                results = benchmark(path, backend, args.repeat)
+                print("{0:24} {1:8} {2:8d} {3:8.1f}ms {4:8.1f}ms {5:8.1f}ms {6:8.1f}ms".format(
+                    os.path.basename(path), backend, results["systems"], 1000 * results["parse"],
+                    1000 * results["process"], 1000 * results["prepared"], 1000 * results["render"]))
+    finally:
+        os.remove(cache_file.name)
+
+
+def errout(*objs):
+    print(*objs, file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,308 @@
+###########################################################################
+#  Vintel - Visual Intel Chat Analyzer									  #
+#  Copyright (C) 2014-15 Sebastian Meyer (sparrow.242.de+eve@gmail.com )  #
+#																		  #
+#  This program is free software: you can redistribute it and/or modify	  #
+#  it under the terms of the GNU General Public License as published by	  #
+#  the Free Software Foundation, either version 3 of the License, or	  #
+#  (at your option) any later version.									  #
+#																		  #
+#  This program is distributed in the hope that it will be useful,		  #
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of		  #
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.	 See the		  #
+#  GNU General Public License for more details.							  #
+#																		  #
+#																		  #
+#  You should have received a copy of the GNU General Public License	  #
+#  along with this program.	 If not, see <http://www.gnu.org/licenses/>.  #
+###########################################################################
+
+import re
+
+import six
+from PyQt4 import QtCore, QtGui, QtSvg
+from PyQt4.QtCore import QPoint, QPointF, QRectF, QUrl, SIGNAL
+from PyQt4.QtGui import QColor, QFont, QFontMetricsF, QGraphicsItem, QGraphicsScene, QGraphicsView, QPen
+
+# The base map is rendered in tiles of this size (map units), each cached at the current zoom
+TILE_SIZE = 256
+TILE_CACHE_KB = 64 * 1024
+
+# How far (pixels) the mouse may move between press and release to be a click on a system
+CLICK_TOLERANCE = 4
+
+# The fonts of the dotlan css classes (family, pixel size, bold)
+NAME_FONT = ("Arial", 9, False)
+SECOND_LINE_FONT = ("Verdana", 7, True)
+STATISTICS_FONT = ("Arial", 8, False)
+
+LOCATION_COLOR = "#8b008d"
+MARKER_COLOR = "#462CFF"
+STATISTICS_COLOR = "blue"
+
+FILL = re.compile(r"fill\s*:\s*([^;]+)")
+RGB = re.compile(r"rgb\(\s*(\d+)\s*,\s*(\d+)\s*,\s*(\d+)\s*\)")
+TRANSLATE = re.compile(r"translate\(\s*([-+.\deE]+)[\s,]+([-+.\deE]+)\s*\)")
+
+
+def svg_color(value):
+    """ The QColor of a svg color (#rrggbb, rgb(r,g,b) or a name)
+    """
+    match = RGB.match(value.strip())
+    if match:
+        return QColor(*[int(part) for part in match.groups()])
+    return QColor(value.strip())
+
+
+def fill_color(style, default):
+    """ The QColor of the fill in a style attribute, default if there is none
+    """
+    match = FILL.search(style or "")
+    return svg_color(match.group(1) if match else default)
+
+
+_fonts = {}
+
+
+def make_font(family, pixel_size, bold):
+    """ The QFont for (family, pixel size, bold), made once
+    """
+    key = (family, pixel_size, bold)
+    if key not in _fonts:
+        font = QFont(family)
+        font.setPixelSize(pixel_size)
+        font.setBold(bold)
+        _fonts[key] = font
+    return _fonts[key]
+
+
+def draw_centered_text(painter, font, x, y, text):
+    """ Draws text like svg with text-anchor middle, (x, y) is the middle of the baseline
+    """
+    painter.setFont(font)
+    width = QFontMetricsF(font).width(text)
+    painter.drawText(QPointF(x - width / 2, y), text)
+
+
+class MapTileItem(QGraphicsItem):
+    """ A part of the static map, rendered from the svg only when it
+        becomes visible or the zoom changes
+    """
+
+    def __init__(self, renderer, rect):
+        QGraphicsItem.__init__(self)
+        self.renderer = renderer
+        self.rect = rect
+        self.setCacheMode(QGraphicsItem.DeviceCoordinateCache)
+
+    def boundingRect(self):
+        return self.rect
+
+    def paint(self, painter, option, widget=None):
+        view_box = self.renderer.viewBoxF()
+        self.renderer.setViewBox(self.rect)
+        self.renderer.render(painter, self.rect)
+        self.renderer.setViewBox(view_box)
+
+
+class SystemItem(QGraphicsItem):
+    """ Paints the state of a system over the static map: the status color,
+        the name, the second line (timer), a located character and the statistics
+    """
+
+    def __init__(self, system):
+        QGraphicsItem.__init__(self)
+        self.system = system
+        document = system.document
+        offset = system.get_transform_offset_point()
+        coords = system.mapCoordinates
+        self.setPos(coords["x"] + offset[0], coords["y"] + offset[1])
+        rect = system.rect
+        self.rect = QRectF(*[float(document.get(rect, key, "0")) for key in ("x", "y", "width", "height")])
+        self.radius = (float(document.get(rect, "rx", "0")), float(document.get(rect, "ry", "0")))
+        name_element = document.select("text", system.svgElement)[0]
+        self.namePosition = QPointF(float(document.get(name_element, "x")), float(document.get(name_element, "y")))
+        self.secondLinePosition = QPointF(float(document.get(system.secondLine, "x")),
+                                          float(document.get(system.secondLine, "y")))
+        width, height = coords["width"], coords["height"]
+        self.locationRect = QRectF(width / 2 - 2.5 - (width / 2 + 4), -4, width + 8, height + 8)
+        self.statisticsPosition = QPointF(width / 2, height + 6)
+        self.bounds = self.locationRect.united(self.rect).united(QRectF(width / 2 - 60, height - 4, 120, 14))
+        self.link = document.get(system.svgElement, "xlink:href",
+                                 u"http://evemaps.dotlan.net/system/" + system.name)
+        self.statisticsVisible = False
+        self.setZValue(2)
+        self.refresh()
+
+    def refresh(self):
+        """ Takes the state of the system from the map document
+        """
+        system = self.system
+        document = system.document
+        rect = system.rects[0] if system.rects else system.rect
+        self.fillColor = fill_color(document.get(rect, "style"), system.UNKNOWN_COLOR)
+        self.secondLineColor = fill_color(document.get(system.secondLine, "style"), "#000000")
+        self.name = system.name
+        self.secondLine = document.text(system.secondLine).strip()
+        self.located = bool(system.get_located_characters())
+        self.statistics = None
+        if system.statisticsElement is not None:
+            self.statistics = document.text(system.statisticsElement)
+        system.changedParts.clear()
+        self.update()
+
+    def set_statistics_visible(self, visible):
+        self.statisticsVisible = visible
+        self.update()
+
+    def boundingRect(self):
+        return self.bounds
+
+    def paint(self, painter, option, widget=None):
+        painter.setRenderHint(QtGui.QPainter.Antialiasing)
+        if self.located:
+            painter.setPen(QtCore.Qt.NoPen)
+            painter.setBrush(QColor(LOCATION_COLOR))
+            painter.drawEllipse(self.locationRect)
+        painter.setPen(QPen(QtCore.Qt.black, 1))
+        painter.setBrush(self.fillColor)
+        painter.drawRoundedRect(self.rect, self.radius[0], self.radius[1])
+        painter.setPen(QtCore.Qt.black)
+        draw_centered_text(painter, make_font(*NAME_FONT), self.namePosition.x(), self.namePosition.y(), self.name)
+        painter.setPen(self.secondLineColor)
+        draw_centered_text(painter, make_font(*SECOND_LINE_FONT), self.secondLinePosition.x(),
+                           self.secondLinePosition.y(), self.secondLine)
+        if self.statisticsVisible and self.statistics:
+            painter.setPen(QColor(STATISTICS_COLOR))
+            draw_centered_text(painter, make_font(*STATISTICS_FONT), self.statisticsPosition.x(),
+                               self.statisticsPosition.y(), self.statistics)
+
+
+class MarkerItem(QGraphicsItem):
+    """ The marker of the selected system with its cross-hairs, fading out
+    """
+
+    def __init__(self, dotlan_map):
+        QGraphicsItem.__init__(self)
+        self.map = dotlan_map
+        self.setZValue(1)
+        self.refresh()
+
+    def refresh(self):
+        document = self.map.document
+        match = TRANSLATE.search(document.get(self.map.marker, "transform", ""))
+        if match:
+            self.setPos(float(match.group(1)), float(match.group(2)))
+        opacity = float(document.get(self.map.marker, "opacity", "0"))
+        self.setOpacity(opacity)
+        self.setVisible(opacity > 0)
+
+    def boundingRect(self):
+        return QRectF(-10000, -10000, 20000, 20000)
+
+    def paint(self, painter, option, widget=None):
+        color = QColor(MARKER_COLOR)
+        painter.setPen(color)
+        painter.drawLine(QPointF(0, -10000), QPointF(0, 10000))
+        painter.drawLine(QPointF(-10000, 0), QPointF(10000, 0))
+        painter.setRenderHint(QtGui.QPainter.Antialiasing)
+        painter.setPen(QtCore.Qt.NoPen)
+        painter.setBrush(color)
+        painter.drawEllipse(QPointF(0, 0), 56, 28)
+
+
+class RasterMapView(QGraphicsView):
+    """ Shows a dotlan.Map without a browser: the static map is rendered with
+        QSvgRenderer into cached tiles, the intel is painted over it by one
+        item per system. Pans by dragging, emits "link_clicked(const QUrl&)"
+        for a click on a system and "scroll_changed" when scrolled.
+    """
+
+    def __init__(self, parent=None):
+        QGraphicsView.__init__(self, parent)
+        self.setScene(QGraphicsScene(self))
+        self.setDragMode(QGraphicsView.ScrollHandDrag)
+        self.setTransformationAnchor(QGraphicsView.AnchorViewCenter)
+        self.setRenderHint(QtGui.QPainter.TextAntialiasing)
+        QtGui.QPixmapCache.setCacheLimit(max(QtGui.QPixmapCache.cacheLimit(), TILE_CACHE_KB))
+        self.map = None
+        self.renderer = None
+        self.systemItems = {}
+        self.markerItem = None
+        self.pressPosition = None
+        self.connect(self.horizontalScrollBar(), SIGNAL("valueChanged(int)"), self._scrolled)
+        self.connect(self.verticalScrollBar(), SIGNAL("valueChanged(int)"), self._scrolled)
+
+    def set_map(self, dotlan_map):
+        """ Shows another map, renders its static part and the current intel
+        """
+        scene = self.scene()
+        scene.clear()
+        self.map = dotlan_map
+        svg = dotlan_map.baseSvg
+        if isinstance(svg, six.text_type):
+            svg = svg.encode("utf-8")
+        self.renderer = QtSvg.QSvgRenderer(QtCore.QByteArray(svg), self)
+        view_box = self.renderer.viewBoxF()
+        scene.setSceneRect(view_box)
+        y = view_box.top()
+        while y < view_box.bottom():
+            x = view_box.left()
+            while x < view_box.right():
+                scene.addItem(MapTileItem(self.renderer, QRectF(x, y, TILE_SIZE, TILE_SIZE).intersected(view_box)))
+                x += TILE_SIZE
+            y += TILE_SIZE
+        dotlan_map.take_changes()
+        self.markerItem = MarkerItem(dotlan_map)
+        scene.addItem(self.markerItem)
+        self.systemItems = {}
+        for system in dotlan_map.systems.values():
+            item = SystemItem(system)
+            item.set_statistics_visible(dotlan_map.statisticsVisible)
+            self.systemItems[system] = item
+            scene.addItem(item)
+
+    def apply_changes(self):
+        """ Repaints what changed on the map since the last call
+        """
+        if self.map is None:
+            return
+        systems, marker_changed, statistics_changed = self.map.take_changes()
+        for system in systems:
+            self.systemItems[system].refresh()
+        if marker_changed:
+            self.markerItem.refresh()
+        if statistics_changed:
+            for item in self.systemItems.values():
+                item.set_statistics_visible(self.map.statisticsVisible)
+
+    def zoomFactor(self):
+        return self.transform().m11()
+
+    def setZoomFactor(self, factor):
+        self.setTransform(QtGui.QTransform.fromScale(factor, factor))
+
+    def scrollPosition(self):
+        return QPoint(self.horizontalScrollBar().value(), self.verticalScrollBar().value())
+
+    def setScrollPosition(self, position):
+        self.horizontalScrollBar().setValue(position.x())
+        self.verticalScrollBar().setValue(position.y())
+
+    def _scrolled(self, value):
+        self.emit(SIGNAL("scroll_changed"))
+
+    def mousePressEvent(self, mouse_event):
+        self.pressPosition = mouse_event.pos()
+        QGraphicsView.mousePressEvent(self, mouse_event)
+
+    def mouseReleaseEvent(self, mouse_event):
+        QGraphicsView.mouseReleaseEvent(self, mouse_event)
+        if self.pressPosition is None:
+            return
+        moved = (mouse_event.pos() - self.pressPosition).manhattanLength()
+        self.pressPosition = None
+        if mouse_event.button() == QtCore.Qt.LeftButton and moved <= CLICK_TOLERANCE:
+            item = self.itemAt(mouse_event.pos())
+            if isinstance(item, SystemItem):
+                self.emit(SIGNAL("link_clicked(const QUrl&)"), QUrl(item.link))
@@ -21,10 +21,12 @@ import logging
 import sqlite3
 import threading
 import time
+import zlib
+from collections import OrderedDict
 
 import six
 
-from dbstructure import update_database
+from .dbstructure import update_database
 
 if six.PY2:
     def to_blob(x):
@@ -42,6 +44,48 @@ else:
         return x
 
 
+# The codecs of the data in the cache table
+CODEC_RAW = 0
+CODEC_ZLIB_TEXT = 1  # utf-8 encoded text, compressed
+CODEC_ZLIB_BYTES = 2
+
+# Values from this size on are compressed
+COMPRESS_MIN_SIZE = 4 * 1024
+
+
+def encode_value(value):
+    """ Returns (the data to store, codec) for a value, strings from
+        COMPRESS_MIN_SIZE on are compressed
+    """
+    if isinstance(value, six.text_type) or (six.PY2 and isinstance(value, str)):
+        if len(value) < COMPRESS_MIN_SIZE:
+            return value, CODEC_RAW
+        if isinstance(value, six.text_type):
+            value = value.encode("utf-8")
+        return to_blob(zlib.compress(value)), CODEC_ZLIB_TEXT
+    if isinstance(value, six.binary_type) and len(value) >= COMPRESS_MIN_SIZE:
+        return to_blob(zlib.compress(value)), CODEC_ZLIB_BYTES
+    return value, CODEC_RAW
+
+
+def decode_value(data, codec):
+    """ The value encode_value made data from, rows without codec are raw
+    """
+    if codec == CODEC_ZLIB_TEXT:
+        return zlib.decompress(bytes(data)).decode("utf-8")
+    elif codec == CODEC_ZLIB_BYTES:
+        return zlib.decompress(bytes(data))
+    return data
+
+
+def put_parameters(key, row):
+    """ The parameters of Cache.PUT_QUERY for the row (data, modified, maxage)
+    """
+    value, modified, max_age = row
+    data, codec = encode_value(value)
+    return key, data, codec, modified, max_age, modified + max_age, modified
+
+
 class Cache(object):
     # Cache checks PATH_TO_CACHE when init, so you can set this on a
     # central place for all Cache instances.
@@ -52,57 +96,300 @@ class Cache(object):
     # check. Following inits of Cache will now, that we allready checked.
     VERSION_CHECKED = False
 
-    # Cache-Instances in various threads: must handle concurrent writings
-    SQLITE_WRITE_LOCK = threading.Lock()
+    # How long (seconds) a write waits for another thread's write to finish
+    BUSY_TIMEOUT = 10
+
+    PUT_QUERY = "INSERT OR REPLACE INTO cache (key, data, codec, modified, maxage, expires, accessed) " \
+                "VALUES (?, ?, ?, ?, ?, ?, ?)"
+
+    # Cache.sweep deletes the rows outdated for SWEEP_OUTDATED_AGE seconds (until then
+    # they are a fallback, e.g. a map while dotlan is not reachable) and the least
+    # recently read rows above MAX_SIZE bytes of data, then frees up to
+    # SWEEP_VACUUM_PAGES pages of the file. The user's configuration (the
+    # SWEEP_KEEP_KEYS and rows without a maxage) is never evicted for size
+    MAX_SIZE = 100 * 1024 * 1024
+    SWEEP_OUTDATED_AGE = 60 * 60 * 24 * 30
+    SWEEP_VACUUM_PAGES = 256
+    SWEEP_KEEP_KEYS = ("settings", "room_names", "region_name", "known_player_names")
+    _accessed = {}  # (path, key): when it was read, for the next sweep, guarded by _memoryLock
+
+    # The connections of the current thread, one per sqlite file. Every
+    # thread has its own, so no connection is shared and none is opened
+    # for every new Cache instance. In WAL mode readers never wait for a
+    # writer and SQLite itself serializes the writers.
+    _connections = threading.local()
+
+    # The rows read last are kept in memory, for all instances and threads:
+    # (path, key): (data, modified, maxage), None if the key is not in the
+    # cache. put_into_cache drops the key. Bigger values are not kept, they
+    # are read seldom (maps) and would use a lot of memory.
+    MEMORY_CACHE_SIZE = 128
+    MEMORY_CACHE_MAX_VALUE = 64 * 1024
+    _memory = OrderedDict()
+    _memoryLock = threading.Lock()
+    _memoryGeneration = 0  # counts the puts, a read racing with a put is not kept
+    memoryHits = 0
+    memoryMisses = 0
+
+    # Write-behind: put_into_cache only queues the row (a later put of the
+    # same key replaces it), the queue is written in one transaction
+    # WRITE_BEHIND_DELAY seconds after the first put by one long-lived writer
+    # thread, or at once when it holds WRITE_BEHIND_MAX rows. Reads see the
+    # queued rows. Call Cache.flush() before exiting.
+    WRITE_BEHIND = False
+    WRITE_BEHIND_DELAY = 5
+    WRITE_BEHIND_MAX = 256
+    _pending = OrderedDict()  # (path, key): (data, modified, maxage), guarded by _memoryLock
+    _flushDue = None  # when the writer flushes the queue, None if nothing is queued
+    _flushWake = threading.Event()  # wakes the writer when _flushDue is set
+    _flushLock = threading.Lock()  # one flush at a time, an older row must not overwrite a newer one
+    _writer = None
 
     def __init__(self, path_to_sqlite_file="cache.sqlite3"):
         """ pathToSQLiteFile=path to sqlite-file to save the cache. will be ignored if you set Cache.PATH_TO_CACHE before init
         """
         if Cache.PATH_TO_CACHE:
             path_to_sqlite_file = Cache.PATH_TO_CACHE
-        self.con = sqlite3.connect(path_to_sqlite_file)
+        self.path = path_to_sqlite_file
         if not Cache.VERSION_CHECKED:
-            with Cache.SQLITE_WRITE_LOCK:
-                self.check_version()
+            self.check_version()
         Cache.VERSION_CHECKED = True
 
+    @property
+    def con(self):
+        return Cache.connection(self.path)
+
+    @classmethod
+    def connection(cls, path):
+        """ The connection of the current thread to the sqlite file, opened on first use
+        """
+        connections = getattr(cls._connections, "byPath", None)
+        if connections is None:
+            connections = cls._connections.byPath = {}
+        con = connections.get(path)
+        if con is None:
+            # Autocommit: every statement is its own transaction, unless one is begun explicitly
+            con = sqlite3.connect(path, timeout=cls.BUSY_TIMEOUT, isolation_level=None)
+            con.execute("PRAGMA journal_mode=WAL")
+            con.execute("PRAGMA synchronous=NORMAL")
+            connections[path] = con
+        return con
+
     def check_version(self):
+        con = self.con
+        # Holds the write lock of the database, so only one thread updates the structure
+        con.execute("BEGIN IMMEDIATE")
         query = "SELECT version FROM version;"
         version = 0
         try:
-            version = self.con.execute(query).fetchall()[0][0]
+            version = con.execute(query).fetchall()[0][0]
         except Exception as e:
             if isinstance(e, sqlite3.OperationalError) and "no such table: version" in str(e):
                 pass
             elif isinstance(e, IndexError):
                 pass
             else:
+                con.rollback()
                 raise e
-        update_database(version, self.con)
+        try:
+            update_database(version, con)
+        except Exception:
+            con.rollback()
+            raise
 
     def put_into_cache(self, key, value, max_age=60 * 60 * 24 * 3):
         """ Putting something in the cache maxAge is maximum age in seconds
         """
-        with Cache.SQLITE_WRITE_LOCK:
-            query = "DELETE FROM cache WHERE key = ?"
-            self.con.execute(query, (key,))
-            query = "INSERT INTO cache (key, data, modified, maxAge) VALUES (?, ?, ?, ?)"
-            self.con.execute(query, (key, value, time.time(), max_age))
-            self.con.commit()
+        if Cache.WRITE_BEHIND:
+            self._queue(key, (value, time.time(), max_age))
+            return
+        self.con.execute(self.PUT_QUERY, put_parameters(key, (value, time.time(), max_age)))
+        self._forget(key)
+
+    def _queue(self, key, row):
+        """ Queues the row for the next flush
+        """
+        memory_key = (self.path, key)
+        with Cache._memoryLock:
+            Cache._pending.pop(memory_key, None)
+            Cache._pending[memory_key] = row
+            Cache._memory.pop(memory_key, None)
+            Cache._memoryGeneration += 1
+            flush_now = len(Cache._pending) >= self.WRITE_BEHIND_MAX
+            if not flush_now:
+                Cache._schedule_flush()
+        if flush_now:
+            Cache.flush()
+
+    @classmethod
+    def _schedule_flush(cls):
+        """ Lets the writer flush in WRITE_BEHIND_DELAY seconds, if no flush is due yet.
+            Call it holding _memoryLock.
+        """
+        if cls._flushDue is not None:
+            return
+        cls._flushDue = time.time() + cls.WRITE_BEHIND_DELAY
+        if cls._writer is None:
+            cls._writer = threading.Thread(target=cls._write_behind, name="cache writer")
+            cls._writer.daemon = True
+            cls._writer.start()
+        cls._flushWake.set()
+
+    @classmethod
+    def _write_behind(cls):
+        """ The writer thread: flushes whenever a flush is due, with its one connection
+        """
+        while True:
+            with cls._memoryLock:
+                due = cls._flushDue
+            if due is None:
+                cls._flushWake.wait()
+            elif due > time.time():
+                cls._flushWake.wait(due - time.time())
+            else:
+                cls.flush()
+                continue
+            cls._flushWake.clear()
+
+    @classmethod
+    def flush(cls):
+        """ Writes the queued rows, in one transaction per sqlite file.
+            Rows that could not be written stay queued, the writer tries again later.
+        """
+        with cls._flushLock:
+            cls._flush()
+
+    @classmethod
+    def _flush(cls):
+        with cls._memoryLock:
+            cls._flushDue = None
+            pending = list(cls._pending.items())
+        by_path = {}
+        for memory_key, row in pending:
+            by_path.setdefault(memory_key[0], []).append((memory_key, row))
+        for path, rows in by_path.items():
+            con = cls.connection(path)
+            try:
+                con.execute("BEGIN IMMEDIATE")
+                con.executemany(cls.PUT_QUERY, [put_parameters(memory_key[1], row) for memory_key, row in rows])
+                con.commit()
+            except Exception as e:
+                con.rollback()
+                logging.error("Writing %d rows to the cache failed: %s", len(rows), e)
+                with cls._memoryLock:
+                    cls._schedule_flush()
+                continue
+            with cls._memoryLock:
+                for memory_key, row in rows:
+                    # A row put again meanwhile stays queued
+                    if cls._pending.get(memory_key) is row:
+                        del cls._pending[memory_key]
+
+    def _forget(self, key):
+        """ Drops the key from the memory
+        """
+        with Cache._memoryLock:
+            Cache._memory.pop((self.path, key), None)
+            Cache._memoryGeneration += 1
+
+    def _remember(self, key, row, generation):
+        """ Keeps the row read for the key in memory, unless a put happened since generation
+        """
+        if row is not None and hasattr(row[0], "__len__") and len(row[0]) > self.MEMORY_CACHE_MAX_VALUE:
+            return
+        with Cache._memoryLock:
+            if generation != Cache._memoryGeneration:
+                return
+            Cache._memory[(self.path, key)] = row
+            while len(Cache._memory) > self.MEMORY_CACHE_SIZE:
+                Cache._memory.popitem(last=False)
+
+    @classmethod
+    def memory_stats(cls):
+        """ The hits and misses of the memory in get_fromcache and the number of rows it holds
+        """
+        with cls._memoryLock:
+            return {"hits": cls.memoryHits, "misses": cls.memoryMisses, "size": len(cls._memory)}
 
     def get_fromcache(self, key, outdated=False):
         """ Getting a value from cache
             key = the key for the value
             outdated = returns the value also if it is outdated
         """
-        query = "SELECT key, data, modified, maxage FROM cache WHERE key = ?"
-        founds = self.con.execute(query, (key,)).fetchall()
-        if len(founds) == 0:
+        memory_key = (self.path, key)
+        with Cache._memoryLock:
+            if memory_key in Cache._pending:
+                row = Cache._pending[memory_key]
+                Cache.memoryHits += 1
+                found = True
+            elif memory_key in Cache._memory:
+                row = Cache._memory.pop(memory_key)
+                Cache._memory[memory_key] = row  # the most recently used now
+                Cache.memoryHits += 1
+                found = True
+            else:
+                Cache.memoryMisses += 1
+                generation = Cache._memoryGeneration
+                found = False
+        if not found:
+            query = "SELECT data, codec, modified, maxage FROM cache WHERE key = ?"
+            founds = self.con.execute(query, (key,)).fetchall()
+            row = None
+            if founds:
+                data, codec, modified, max_age = founds[0]
+                row = (decode_value(data, codec), modified, max_age)
+            self._remember(key, row, generation)
+        if row is None:
             return None
-        elif founds[0][2] + founds[0][3] < time.time() and not outdated:
+        with Cache._memoryLock:
+            Cache._accessed[memory_key] = time.time()
+        if row[1] + row[2] < time.time() and not outdated:
             return None
         else:
-            return founds[0][1]
+            return row[0]
+
+    def sweep(self):
+        """ Notes the reads since the last sweep, deletes the long outdated rows and the
+            least recently read ones above MAX_SIZE and vacuums a part of the file.
+            Takes a while, call it from a background thread. Returns the number of rows deleted.
+        """
+        con = self.con
+        now = time.time()
+        with Cache._memoryLock:
+            accessed = [(when, key) for (path, key), when in Cache._accessed.items() if path == self.path]
+            for when, key in accessed:
+                del Cache._accessed[(self.path, key)]
+        if accessed:
+            con.execute("BEGIN IMMEDIATE")
+            con.executemany("UPDATE cache SET accessed = ? WHERE key = ?", accessed)
+            con.commit()
+
+        outdated_before = now - self.SWEEP_OUTDATED_AGE
+        deleted = [row[0] for row in con.execute("SELECT key FROM cache WHERE expires < ?", (outdated_before,))]
+        query = "SELECT SUM(LENGTH(data)) FROM cache WHERE expires >= ?"
+        size = con.execute(query, (outdated_before,)).fetchone()[0] or 0
+        if size > self.MAX_SIZE:
+            query = "SELECT key, LENGTH(data) FROM cache WHERE expires >= ? AND maxage IS NOT NULL " \
+                    "ORDER BY accessed"
+            for key, length in con.execute(query, (outdated_before,)).fetchall():
+                if size <= self.MAX_SIZE:
+                    break
+                if key in self.SWEEP_KEEP_KEYS:
+                    continue
+                deleted.append(key)
+                size -= length or 0
+        if deleted:
+            con.execute("BEGIN IMMEDIATE")
+            con.executemany("DELETE FROM cache WHERE key = ?", [(key,) for key in deleted])
+            con.commit()
+            for key in deleted:
+                self._forget(key)
+            logging.info("Cache sweep deleted %d rows", len(deleted))
+
+        # Needs auto_vacuum = INCREMENTAL, switched on by the database update to version 5
+        if con.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+            con.execute("PRAGMA incremental_vacuum({0})".format(int(self.SWEEP_VACUUM_PAGES))).fetchall()
+        return len(deleted)
 
     def recall_and_apply_settings(self, responder, settings_identifier):
         settings = self.get_fromcache(settings_identifier)
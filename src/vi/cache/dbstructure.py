@@ -37,9 +37,28 @@ def update_database(old_version, con):
     if old_version < 2:
         queries += ["CREATE TABLE cache (key VARCHAR PRIMARY KEY, data BLOB, modified INT, maxage INT)",
                     "UPDATE version SET version = 2"]
+    if old_version < 3:
+        # expires = modified + maxage and the last read, indexed for Cache.sweep
+        queries += ["ALTER TABLE cache ADD COLUMN expires INT",
+                    "ALTER TABLE cache ADD COLUMN accessed INT",
+                    "UPDATE cache SET expires = modified + maxage, accessed = modified",
+                    "CREATE INDEX cache_expires ON cache (expires)",
+                    "CREATE INDEX cache_accessed ON cache (accessed)",
+                    "UPDATE version SET version = 3"]
+    if old_version < 4:
+        # How data is encoded, see cache.encode_value, the rows so far are raw
+        queries += ["ALTER TABLE cache ADD COLUMN codec INT DEFAULT 0",
+                    "UPDATE version SET version = 4"]
+    if old_version < 5:
+        # Lets Cache.sweep free pages with incremental_vacuum, takes effect with the VACUUM below
+        queries += ["PRAGMA auto_vacuum = INCREMENTAL",
+                    "UPDATE version SET version = 5"]
     for query in queries:
         con.execute(query)
     for update in databaseUpdates:
         if update[1]:
             con.execute(update[0])
     con.commit()
+    if old_version < 5:
+        # Rewrites the whole file once, it can not run inside the transaction
+        con.execute("VACUUM")
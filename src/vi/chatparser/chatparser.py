@@ -20,98 +20,173 @@
 import datetime
 import os
 import time
+from collections import OrderedDict, deque
+from multiprocessing.pool import ThreadPool
 
 import six
 from PyQt4.QtGui import QMessageBox
-from bs4 import BeautifulSoup
-from vi import states
+from vi import evegate, states
+from vi.resolver import SystemNameResolver
 
-from .parser_functions import parse_status
-from .parser_functions import parse_urls, parse_ships, parse_systems
-
-if six.PY2:
-    from io import open
+from .logtail import LogTail
+from .parser_functions import annotate, parse_status, parse_timestamp, split_line
 
 # Names the local chatlogs could start with (depends on l10n of the client)
 LOCAL_NAMES = ("Local", "Lokal", six.text_type("\u041B\u043E\u043A\u0430\u043B\u044C\u043D\u044B\u0439"))
 
+# EVE names the file like room_20140913_200737.txt (the time the file was created)
+LOG_FILENAME_SUFFIX_LENGTH = 20
+
+# EVE starts every chatlog with a header of this many lines
+LOG_HEADER_LINES = 12
+
+# How long (seconds, by the timestamp of the messages) and how many messages we
+# remember to find duplicates, and how many messages per room for the lookback
+MESSAGE_HISTORY_MAX_AGE = 60 * 60
+MESSAGE_HISTORY_MAX_SIZE = 5000
+ROOM_HISTORY_SIZE = 5
+
+# On startup we read the logs of the last day (seconds) with this many workers,
+# only intel younger than BACKFILL_INTEL_MAX_AGE is used to prime the systems
+BACKFILL_MAX_AGE = 60 * 60 * 24
+BACKFILL_INTEL_MAX_AGE = 60 * 60
+BACKFILL_WORKERS = 4
+
 
 class ChatParser(object):
     """ ChatParser will analyze every new line that was found inside the Chatlogs.
     """
 
-    def __init__(self, path, rooms, systems):
+    def __init__(self, path, rooms, systems, resolver=None):
         """ path = the path with the logs
-            rooms = the rooms to parse"""
+            rooms = the rooms to parse
+            resolver = the SystemNameResolver of the map (built from systems if None)"""
         self.path = path  # the path with the chatlog
         self.rooms = rooms  # the rooms to watch (excl. local)
         self.systems = systems  # the known systems as dict name: system
+        self.resolver = resolver if resolver else SystemNameResolver(systems)
         self.fileData = {}  # informations about the files in the directory
-        self.knownMessages = []  # message we allready analyzed
+        self.knownMessages = MessageHistory()  # message we allready analyzed
         self.locations = {}  # informations about the location of a char
         self.ignoredPaths = []
-        self._collect_init_file_data(path)
 
-    def _collect_init_file_data(self, path):
+    def set_systems(self, systems, resolver=None):
+        """ Parses for the systems of another map from now on, keeping the
+            files and messages read so far
+        """
+        self.systems = systems
+        self.resolver = resolver if resolver else SystemNameResolver(systems)
+
+    def known_intel(self, since=None):
+        """ The intel of the message history (newer than since, if given) as
+            new messages with the systems of the current map, the oldest first.
+            Primes a map the parser did not parse for.
+        """
+        messages = []
+        for message in self.knownMessages:
+            if message.status not in (states.ALARM, states.CLEAR, states.REQUEST):
+                continue
+            if since is not None and message.timestamp <= since:
+                continue
+            systems = set()
+            html, plain_texts = annotate(message.plainText, self.resolver, systems)
+            if not systems:
+                continue
+            intel = Message(message.room, html, message.timestamp, message.user, systems, message.upperText,
+                            message.plainText, message.status)
+            for system in systems:
+                system.messages.append(intel)
+            messages.append(intel)
+        return messages
+
+    def collect_backfill(self, max_age=BACKFILL_MAX_AGE, workers=BACKFILL_WORKERS):
+        """ Reads all logs changed in the last max_age seconds with a pool of
+            workers. Does not touch the parser, so it can run in any thread.
+            The result is for apply_backfill.
+        """
         current_time = time.time()
-        max_diff = 60 * 60 * 24  # what is 1 day in seconds
-        for filename in os.listdir(path):
-            full_path = os.path.join(path, filename)
-            file_time = os.path.getmtime(full_path)
-            if current_time - file_time < max_diff:
-                self.add_file(full_path)
+        intel_since = evegate.current_eve_time() - datetime.timedelta(seconds=BACKFILL_INTEL_MAX_AGE)
+        jobs = []
+        for filename in os.listdir(self.path):
+            entry = split_log_filename(filename)
+            if entry is None:
+                continue
+            full_path = os.path.join(self.path, filename)
+            try:
+                file_time = os.path.getmtime(full_path)
+            except OSError:
+                continue
+            if current_time - file_time < max_age:
+                roomname = entry[0]
+                keep_since = intel_since if roomname in self.rooms else None
+                jobs.append((full_path, roomname, keep_since))
+        if not jobs:
+            return []
+        pool = ThreadPool(min(workers, len(jobs)))
+        try:
+            return pool.map(lambda job: read_backfill_file(*job), jobs)
+        finally:
+            pool.close()
+            pool.join()
+
+    def apply_backfill(self, results):
+        """ Takes over the files read by collect_backfill and parses their
+            lines. Must run in the thread using the parser.
+            Yields the messages, the oldest first, a line is parsed when
+            its message is taken.
+        """
+        lines = []
+        for result in results:
+            if result.path in self.fileData or result.path in self.ignoredPaths:
+                continue
+            if result.error is not None:
+                self.ignoredPaths.append(result.path)
+                QMessageBox.warning(None, "Read a log file failed!",
+                                    "File: {0} - problem: {1}".format(result.path, six.text_type(result.error)), "OK")
+                continue
+            self.fileData[result.path] = result.fileData
+            for parts in result.lines:
+                lines.append((parts, result.path, result.roomname))
+        lines.sort(key=lambda line: line[0][0])
+        for parts, path, roomname in lines:
+            if roomname in LOCAL_NAMES:
+                message = self._parts_to_location(path, parts)
+            else:
+                message = self._parts_to_message(parts, roomname)
+            if message:
+                yield message
 
     def add_file(self, path):
-        lines = None
-        content = ""
-        filename = os.path.basename(path)
-        roomname = filename[:-20]
+        """ Reads the lines appended to the file since the last call
+            (all lines on the first call) and returns them
+        """
+        roomname = log_roomname(path)
+        if path not in self.fileData:
+            self.fileData[path] = {}
+        file_data = self.fileData[path]
+        if "tail" not in file_data:
+            file_data["tail"] = LogTail(path)
         try:
-            with open(path, "r", encoding='utf-16-le') as f:
-                content = f.read()
+            lines = file_data["tail"].read_lines()
         except Exception as e:
             self.ignoredPaths.append(path)
             QMessageBox.warning(None, "Read a log file failed!", "File: {0} - problem: {1}".format(path, six.text_type(e)), "OK")
             return None
 
-        lines = content.split("\n")
-        if path not in self.fileData or (roomname in LOCAL_NAMES and "charname" not in self.fileData.get(path, [])):
-            self.fileData[path] = {}
-            if roomname in LOCAL_NAMES:
-                charname = None
-                session_start = None
-                # for local-chats we need more infos
-                for line in lines:
-                    if "Listener:" in line:
-                        charname = line[line.find(":") + 1:].strip()
-                    elif "Session started:" in line:
-                        session_str = line[line.find(":") + 1:].strip()
-                        session_start = datetime.datetime.strptime(session_str, "%Y.%m.%d %H:%M:%S")
-                    if charname and session_start:
-                        self.fileData[path]["charname"] = charname
-                        self.fileData[path]["sessionstart"] = session_start
-                        break
-        self.fileData[path]["lines"] = len(lines)
+        if roomname in LOCAL_NAMES:
+            # for local-chats we need more infos
+            parse_local_header(lines, file_data)
         return lines
 
     def _line_to_message(self, line, roomname):
-        # finding the timestamp
-        time_start = line.find("[") + 1
-        time_ends = line.find("]")
-        time_str = line[time_start:time_ends].strip()
-        try:
-            timestamp = datetime.datetime.strptime(time_str, "%Y.%m.%d %H:%M:%S")
-        except ValueError:
+        parts = split_line(line)
+        if parts is None:
             return None
-        # finding the username of the poster
-        user_ends = line.find(">")
-        username = line[time_ends + 1:user_ends].strip()
-        # finding the pure message
-        text = line[user_ends + 1:].strip()  # text will the text to work an
+        return self._parts_to_message(parts, roomname)
+
+    def _parts_to_message(self, parts, roomname):
+        timestamp, username, text = parts  # text will the text to work an
         original_text = text
-        formated_text = u"<rtext>{0}</rtext>".format(text)
-        soup = BeautifulSoup(formated_text, 'html.parser')
-        rtext = soup.select("rtext")[0]
         systems = set()
         upper_text = text.upper()
 
@@ -129,53 +204,43 @@ class ChatParser(object):
             message.status = states.IGNORE
             return message
 
-        while parse_ships(rtext):
-            continue
-        while parse_urls(rtext):
-            continue
-        while parse_systems(self.systems, rtext, systems):
-            continue
-        parsed_status = parse_status(rtext)
+        html, plain_texts = annotate(text, self.resolver, systems)
+        parsed_status = parse_status(plain_texts)
         status = parsed_status if parsed_status is not None else states.ALARM
 
         # If message says clear and no system? Maybe an answer to a request?
         if status == states.CLEAR and not systems:
             max_search = 2  # we search only max_search messages in the room
-            for count, oldMessage in enumerate(oldMessage for oldMessage in self.knownMessages[-1::-1] if oldMessage.room == roomname):
+            for count, oldMessage in enumerate(self.knownMessages.last_in_room(roomname)):
                 if oldMessage.systems and oldMessage.status == states.REQUEST:
                     for system in oldMessage.systems:
                         systems.add(system)
                     break
                 if count > max_search:
                     break
-        message.message = six.text_type(rtext)
+        message.message = html
         message.status = status
-        self.knownMessages.append(message)
+        self.knownMessages.add(message)
         if systems:
             for system in systems:
                 system.messages.append(message)
         return message
 
     def _parse_local(self, path, line):
-        message = []
         """ Parsing a line from the local chat. Can contain the system of the char
         """
+        parts = split_line(line)
+        if parts is None:
+            return None
+        return self._parts_to_location(path, parts)
+
+    def _parts_to_location(self, path, parts):
+        message = []
         charname = self.fileData[path]["charname"]
         if charname not in self.locations:
             self.locations[charname] = {"system": "?", "timestamp": datetime.datetime(1970, 1, 1, 0, 0, 0, 0)}
 
-        # Finding the timestamp
-        time_start = line.find("[") + 1
-        time_ends = line.find("]")
-        time_str = line[time_start:time_ends].strip()
-        timestamp = datetime.datetime.strptime(time_str, "%Y.%m.%d %H:%M:%S")
-
-        # Finding the username of the poster
-        user_ends = line.find(">")
-        username = line[time_ends + 1:user_ends].strip()
-
-        # Finding the pure message
-        text = line[user_ends + 1:].strip()  # text will the text to work an
+        timestamp, username, text = parts
         if username in ("EVE-System", "EVE System"):
             if ":" in text:
                 system = text.split(":")[1].strip().replace("*", "").upper()
@@ -195,19 +260,18 @@ class ChatParser(object):
         if path in self.ignoredPaths:
             return []
         # Checking if we must do anything with the changed file.
-        # We only need those which name is in the rooms-list
-        # EvE names the file like room_20140913_200737.txt, so we don't need
-        # the last 20 chars
-        filename = os.path.basename(path)
-        roomname = filename[:-20]
-        if path not in self.fileData:
-            # seems eve created a new file. New Files have 12 lines header
-            self.fileData[path] = {"lines": 13}
-        old_length = self.fileData[path]["lines"]
+        # We only need chatlogs, the room is in the name of the file
+        roomname = log_roomname(path)
+        if roomname is None:
+            return []
         lines = self.add_file(path)
         if path in self.ignoredPaths:
             return []
-        for line in lines[old_length - 1:]:
+        # the first lines of a file are the header, not chat
+        first_index = self.fileData[path]["tail"].lines - len(lines)
+        for index, line in enumerate(lines, first_index):
+            if index < LOG_HEADER_LINES:
+                continue
             line = line.strip()
             if len(line) > 2:
                 message = None
@@ -220,6 +284,130 @@ class ChatParser(object):
         return messages
 
 
+def split_log_filename(filename):
+    """ Returns (roomname, creation time as datetime) for the filename of a
+        chatlog, None for all other filenames
+    """
+    if len(filename) <= LOG_FILENAME_SUFFIX_LENGTH or not filename.endswith(".txt"):
+        return None
+    stamp = filename[-LOG_FILENAME_SUFFIX_LENGTH:-4]  # _20140913_200737
+    if stamp[0] != "_" or stamp[9] != "_" or not (stamp[1:9] + stamp[10:]).isdigit():
+        return None
+    try:
+        created = datetime.datetime(int(stamp[1:5]), int(stamp[5:7]), int(stamp[7:9]), int(stamp[10:12]), int(stamp[12:14]),
+                                    int(stamp[14:16]))
+    except ValueError:
+        return None
+    return filename[:-LOG_FILENAME_SUFFIX_LENGTH], created
+
+
+def log_roomname(path):
+    """ The room of the chatlog at path, None if it is no chatlog
+    """
+    entry = split_log_filename(os.path.basename(path))
+    return entry[0] if entry else None
+
+
+def parse_local_header(lines, file_data):
+    """ Looks for the listener and the start of the session in the header
+        of a local chatlog and puts them to file_data (charname, sessionstart)
+    """
+    for line in lines:
+        if "charname" in file_data and "sessionstart" in file_data:
+            break
+        if "Listener:" in line:
+            file_data["charname"] = line[line.find(":") + 1:].strip()
+        elif "Session started:" in line:
+            session_str = line[line.find(":") + 1:].strip()
+            file_data["sessionstart"] = parse_timestamp(session_str)
+
+
+class BackfillFile(object):
+    """ What the backfill read from one chatlog
+    """
+
+    def __init__(self, path, roomname):
+        self.path = path
+        self.roomname = roomname
+        self.fileData = {"tail": LogTail(path)}  # becomes ChatParser.fileData[path]
+        self.lines = []  # (timestamp, username, text) of the lines to parse
+        self.error = None
+
+
+def read_backfill_file(path, roomname, keep_since=None):
+    """ Reads a whole chatlog for the backfill (runs in a worker thread).
+        Local chats keep their system changes, intel rooms the lines
+        younger than keep_since. Other files are only read to the end.
+    """
+    result = BackfillFile(path, roomname)
+    try:
+        lines = result.fileData["tail"].read_lines()
+    except Exception as e:
+        result.error = e
+        return result
+    is_local = roomname in LOCAL_NAMES
+    if is_local:
+        parse_local_header(lines, result.fileData)
+    elif keep_since is None:
+        return result
+    for line in lines[LOG_HEADER_LINES:]:
+        parts = split_line(line.strip())
+        if parts is None:
+            continue
+        if is_local:
+            if parts[1] in ("EVE-System", "EVE System"):
+                result.lines.append(parts)
+        elif parts[0] >= keep_since:
+            result.lines.append(parts)
+    return result
+
+
+class MessageHistory(object):
+    """ The messages the parser allready analyzed. Finding a duplicate is a
+        lookup by the key of the message, and for every room the last few
+        messages are kept in order. Messages older than max_age (compared
+        to the newest one) and above max_size are forgotten.
+    """
+
+    def __init__(self, max_age=MESSAGE_HISTORY_MAX_AGE, max_size=MESSAGE_HISTORY_MAX_SIZE, room_size=ROOM_HISTORY_SIZE):
+        self.maxAge = datetime.timedelta(seconds=max_age)
+        self.maxSize = max_size
+        self.roomSize = room_size
+        self._messages = OrderedDict()  # message: timestamp, oldest first
+        self._rooms = {}  # room: the last messages of the room
+
+    def __contains__(self, message):
+        return message in self._messages
+
+    def __len__(self):
+        return len(self._messages)
+
+    def __iter__(self):
+        """ The messages, oldest first
+        """
+        return iter(list(self._messages))
+
+    def add(self, message):
+        self._messages[message] = message.timestamp
+        if message.room not in self._rooms:
+            self._rooms[message.room] = deque(maxlen=self.roomSize)
+        self._rooms[message.room].append(message)
+        self._expire(message.timestamp)
+
+    def last_in_room(self, room):
+        """ The last messages of the room, newest first
+        """
+        return reversed(self._rooms.get(room, ()))
+
+    def _expire(self, newest):
+        oldest_allowed = newest - self.maxAge
+        while self._messages:
+            timestamp = next(six.itervalues(self._messages))
+            if len(self._messages) <= self.maxSize and timestamp >= oldest_allowed:
+                break
+            self._messages.popitem(last=False)
+
+
 class Message(object):
     def __init__(self, room, message, timestamp, user, systems, upper_text, plain_text="", status=states.ALARM):
         self.room = room  # chatroom the message was posted
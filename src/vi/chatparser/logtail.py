@@ -0,0 +1,63 @@
+###########################################################################
+#  Vintel - Visual Intel Chat Analyzer									  #
+#  Copyright (C) 2014-15 Sebastian Meyer (sparrow.242.de+eve@gmail.com )  #
+#																		  #
+#  This program is free software: you can redistribute it and/or modify	  #
+#  it under the terms of the GNU General Public License as published by	  #
+#  the Free Software Foundation, either version 3 of the License, or	  #
+#  (at your option) any later version.									  #
+#																		  #
+#  This program is distributed in the hope that it will be useful,		  #
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of		  #
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.	 See the		  #
+#  GNU General Public License for more details.							  #
+#																		  #
+#																		  #
+#  You should have received a copy of the GNU General Public License	  #
+#  along with this program.	 If not, see <http://www.gnu.org/licenses/>.  #
+###########################################################################
+
+import codecs
+import os
+
+# EVE writes the chatlogs as UTF-16 (little endian, with BOM)
+LOG_ENCODING = "utf-16-le"
+
+
+class LogTail(object):
+    """ Follows one chatlog and returns only the lines appended since the
+        last read. We keep the byte offset and an incremental decoder, so a
+        half written code unit or line at the end of the file is kept back
+        until EVE has written the rest of it.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.offset = 0  # bytes of the file we allready consumed
+        self.lines = 0  # complete lines we allready returned
+        self._decoder = codecs.getincrementaldecoder(LOG_ENCODING)()
+        self._pending = u""  # text of a line without its newline (yet)
+
+    def reset(self):
+        self.offset = 0
+        self.lines = 0
+        self._decoder.reset()
+        self._pending = u""
+
+    def read_lines(self):
+        """ Reads the bytes appended since the last call and returns the
+            new, complete lines (without the line break)
+        """
+        with open(self.path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            if size < self.offset:
+                # the file was truncated or replaced, start over
+                self.reset()
+            f.seek(self.offset)
+            data = f.read(size - self.offset)
+        self.offset += len(data)
+        text = self._pending + self._decoder.decode(data)
+        lines = text.split(u"\n")
+        self._pending = lines.pop()
+        self.lines += len(lines)
+        return lines
@@ -20,43 +20,90 @@
 """ 12.02.2015
 	I know this is a little bit dirty, but I prefer to have all the functions
 	to parse the chat in this file together.
-	Wer are now work directly with the html-formatted text, which we use to
-	display it. We are using a HTML/XML-Parser to have the benefit, that we
-	can only work and analyze those text, that is still not on tags, because
-	all the text in tags was allready identified.
-	f.e. the ship_parser:
-		we call it from the chatparser and give them the rtext (richtext).
-		if the parser hits a shipname, it will modifiy the tree by creating
-		a new tag and replace the old text with it (calls tet_replace),
-		than it returns True.
-		The chatparser will call the function again until it return False
-		(None is False) otherwise.
-		We have to call the parser again after a hit, because a hit will change
-		the tree and so the original generator is not longer stable.
+	We work on the plain text of a message and only collect marks (start,
+	end and the html to show for that part of the text). Every finder only
+	looks at the parts of the text which are not marked yet, because all the
+	marked text was allready identified. The order is: ships, urls, systems.
+	f.e. the ship finder:
+		it gets the text and the unmarked parts of it. For every shipname in
+		these parts it returns a mark. The text is never changed, so one pass
+		is enough, no matter how many hits we have.
+	At the end annotate puts the text and the marks together to the html we
+	use to display the message. The html is the one the BeautifulSoup rewrite
+	loops made, with one difference: markup in the chat is shown as text.
 """
 
-import six
+import datetime
+import re
+from xml.sax.saxutils import escape
+
+try:
+    from html import unescape
+except ImportError:  # Python 2
+    from HTMLParser import HTMLParser
+    unescape = HTMLParser().unescape
 
-import vi.evegate as evegate
-from bs4 import BeautifulSoup
-from bs4.element import NavigableString
 from vi import states
 
+from .shipmatcher import ship_matcher
+
 CHARS_TO_IGNORE = ("*", "?", ",", "!", ".")
 
+# words to ignore on the system parser. use UPPER CASE
+WORDS_TO_IGNORE = ("IN", "IS", "AS")
+
+_WORD_RE = re.compile(r"\S+", re.UNICODE)
+
+# Many lines share the same second, so we remember the last parsed timestamps
+TIMESTAMP_CACHE_SIZE = 512
+_timestampCache = {}
+
+
+def parse_timestamp(time_str):
+    """ Parses a timestamp as EVE writes it (2015.01.24 19:03:07) without
+        strptime. Returns None if time_str is no such timestamp
+    """
+    timestamp = _timestampCache.get(time_str)
+    if timestamp is not None:
+        return timestamp
+    if (len(time_str) != 19 or time_str[4] != "." or time_str[7] != "." or time_str[10] != " " or
+            time_str[13] != ":" or time_str[16] != ":"):
+        return None
+    fields = (time_str[0:4], time_str[5:7], time_str[8:10], time_str[11:13], time_str[14:16], time_str[17:19])
+    if not "".join(fields).isdigit():
+        return None
+    try:
+        timestamp = datetime.datetime(*[int(field) for field in fields])
+    except ValueError:
+        return None
+    if len(_timestampCache) >= TIMESTAMP_CACHE_SIZE:
+        _timestampCache.clear()
+    _timestampCache[time_str] = timestamp
+    return timestamp
 
-def text_replace(element, new_text):
-    new_text = "<t>" + new_text + "</t>"
-    new_elements = []
-    for newPart in BeautifulSoup(new_text, 'html.parser').select("t")[0].contents:
-        new_elements.append(newPart)
-    for newElement in new_elements:
-        element.insert_before(newElement)
-    element.replace_with(six.text_type(""))
 
+def split_line(line):
+    """ Splits a chat line like "[ 2015.01.24 19:03:07 ] Username > text"
+        Returns (timestamp, username, text) or None if it is no chat line
+    """
+    time_start = line.find("[")
+    if time_start < 0:
+        return None
+    time_ends = line.find("]", time_start)
+    if time_ends < 0:
+        return None
+    timestamp = parse_timestamp(line[time_start + 1:time_ends].strip())
+    if timestamp is None:
+        return None
+    user_ends = line.find(">", time_ends)
+    if user_ends < 0:
+        return None
+    return timestamp, line[time_ends + 1:user_ends].strip(), line[user_ends + 1:].strip()
 
-def parse_status(rtext):
-    texts = [t for t in rtext.contents if isinstance(t, NavigableString)]
+
+def parse_status(texts):
+    """ texts = the parts of the message which are no ship, url or system
+    """
     for text in texts:
         upper_text = text.strip().upper()
         original_text = upper_text
@@ -73,59 +120,70 @@ def parse_status(rtext):
             return states.CLEAR
 
 
-def parse_ships(rtext):
-    def format_ship_name(text, word):
+def find_ships(text, gaps):
+    def format_ship_name(word):
         new_text = u"""<span style="color:#d95911;font-weight:bold"> {0}</span>"""
-        text = text.replace(word, new_text.format(word))
-        return text
+        return new_text.format(escape(word))
 
-    texts = [t for t in rtext.contents if isinstance(t, NavigableString)]
-    for text in texts:
-        upper_text = text.upper()
-        for shipName in evegate.SHIPNAMES:
-            if shipName in upper_text:
-                hit = True
-                start = upper_text.find(shipName)
-                end = start + len(shipName)
-                if ((start > 0 and upper_text[start - 1] not in (" ", "X")) or (
-                                end < len(upper_text) - 1 and upper_text[end] not in ("S", " "))):
-                    hit = False
-                if hit:
-                    ship_in_text = text[start:end]
-                    formatted = format_ship_name(text, ship_in_text)
-                    text_replace(text, formatted)
-                    return True
-
-
-def parse_systems(systems, rtext, found_systems):
-    system_names = systems.keys()
-
-    # words to ignore on the system parser. use UPPER CASE
-    words_to_ignore = ("IN", "IS", "AS")
-
-    def format_system(text, word, system):
-        new_text = u"""<a style="color:#CC8800;font-weight:bold" href="mark_system/{0}">{1}</a>"""
-        text = text.replace(word, new_text.format(system, word))
-        return text
-
-    texts = [t for t in rtext.contents if isinstance(t, NavigableString) and len(t)]
-    for wtIdx, text in enumerate(texts):
-        worktext = text
-        for char in CHARS_TO_IGNORE:
-            worktext = worktext.replace(char, "")
+    marks = []
+    matcher = ship_matcher()
+    for gap_start, gap_end in gaps:
+        for start, end in matcher.find_ships(text[gap_start:gap_end].upper()):
+            start += gap_start
+            end += gap_start
+            marks.append((start, end, format_ship_name(text[start:end])))
+    return marks
+
+
+def find_urls(text, gaps):
+    def format_url(url):
+        new_text = u"""<a href="link/{0}" style="color:#28a5ed;font-weight:bold">{1}</a>"""
+        return new_text.format(escape(url, {'"': "&quot;"}), escape(url))
 
-        # Drop redundant whitespace so as to not throw off word index
-        worktext = ' '.join(worktext.split())
-        words = worktext.split(" ")
+    # yes, this is faster than regex and less complex to read
+    marks = []
+    prefixes = ("http://", "https://")
+    for gap_start, gap_end in gaps:
+        start = text.find("http", gap_start, gap_end)
+        while start >= 0:
+            if text.startswith(prefixes, start, gap_end):
+                stop = text.find(" ", start, gap_end)
+                if stop < 0:
+                    stop = gap_end
+                marks.append((start, stop, format_url(text[start:stop])))
+            else:
+                stop = start + 1
+            start = text.find("http", stop, gap_end)
+    return marks
 
-        for idx, word in enumerate(words):
+
+def find_systems(text, gaps, resolver, found_systems):
+    """ resolver = a SystemNameResolver for the systems of the map
+        found_systems = a set, all found systems are added to it
+    """
+    def format_system(word, system):
+        new_text = u"""<a href="mark_system/{0}" style="color:#CC8800;font-weight:bold">{1}</a>"""
+        return new_text.format(system, escape(word))
+
+    marks = []
+    for gap_start, gap_end in gaps:
+        # the words of the gap without the chars to ignore, and where they are
+        words = []
+        for match in _WORD_RE.finditer(text, gap_start, gap_end):
+            word = match.group()
+            for char in CHARS_TO_IGNORE:
+                word = word.replace(char, "")
+            if word:
+                words.append((word, match.start(), match.group()))
+
+        for idx, (word, word_start, token) in enumerate(words):
 
             # Is this about another a system's gate?
             if len(words) > idx + 1:
-                if words[idx + 1].upper() == 'GATE':
+                if words[idx + 1][0].upper() == 'GATE':
                     bailout = True
                     if len(words) > idx + 2:
-                        if words[idx + 2].upper() == 'TO':
+                        if words[idx + 2][0].upper() == 'TO':
                             # Could be '___ GATE TO somewhere' so check this one.
                             bailout = False
                     if bailout:
@@ -134,68 +192,72 @@ def parse_systems(systems, rtext, found_systems):
                         continue
 
             upper_word = word.upper()
-            if upper_word != word and upper_word in words_to_ignore: continue
-            if upper_word in system_names:  # - direct hit on name
-                found_systems.add(systems[upper_word])  # of the system?
-                formatted_text = format_system(text, word, upper_word)
-                text_replace(text, formatted_text)
-                return True
-            elif 1 < len(upper_word) < 5:  # - upperWord < 4 chars.
-                for system in system_names:  # system begins with?
-                    if system.startswith(upper_word):
-                        found_systems.add(systems[system])
-                        formatted_text = format_system(text, word, system)
-                        text_replace(text, formatted_text)
-                        return True
-            elif "-" in upper_word and len(upper_word) > 2:  # - short with - (minus)
-                upper_word_parts = upper_word.split("-")  # (I-I will match I43-IF3)
-                for system in system_names:
-                    system_parts = system.split("-")
-                    if (len(upper_word_parts) == 2 and len(system_parts) == 2 and len(upper_word_parts[0]) > 1 and len(
-                            upper_word_parts[1]) > 1 and len(system_parts[0]) > 1 and len(system_parts[1]) > 1 and len(
-                        upper_word_parts) == len(system_parts) and upper_word_parts[0][0] == system_parts[0][0] and
-                                upper_word_parts[1][0] == system_parts[1][0]):
-                        found_systems.add(systems[system])
-                        formatted_text = format_system(text, word, system)
-                        text_replace(text, formatted_text)
-                        return True
-            elif len(upper_word) > 1:  # what if F-YH58 is named FY?
-                for system in system_names:
-                    cleared_system = system.replace("-", "")
-                    if cleared_system.startswith(upper_word):
-                        found_systems.add(systems[system])
-                        formatted_text = format_system(text, word, system)
-                        text_replace(text, formatted_text)
-                        return True
-
-    return False
-
-
-def parse_urls(rtext):
-    def find_urls(s):
-        # yes, this is faster than regex and less complex to read
-        urls = []
-        prefixes = ("http://", "https://")
-        for prefix in prefixes:
-            start = 0
-            while start >= 0:
-                start = s.find(prefix, start)
-                if start >= 0:
-                    stop = s.find(" ", start)
-                    if stop < 0:
-                        stop = len(s)
-                    urls.append(s[start:stop])
-                    start += 1
-        return urls
-
-    def format_url(text, url):
-        new_text = u"""<a style="color:#28a5ed;font-weight:bold" href="link/{0}">{0}</a>"""
-        text = text.replace(url, new_text.format(url))
-        return text
-
-    texts = [t for t in rtext.contents if isinstance(t, NavigableString)]
-    for text in texts:
-        urls = find_urls(text)
-        for url in urls:
-            text_replace(text, format_url(text, url))
-            return True
+            if upper_word != word and upper_word in WORDS_TO_IGNORE:
+                continue
+            system = resolver.resolve(upper_word)
+            if system:
+                found_systems.add(resolver.systems[system])
+                position = token.find(word)
+                if position >= 0:
+                    start = word_start + position
+                    marks.append((start, start + len(word), format_system(word, system)))
+    return marks
+
+
+def _remaining_gaps(gaps, marks):
+    """ The parts of the gaps which are not covered by marks
+    """
+    if not marks:
+        return gaps
+    marks = sorted(marks)
+    remaining = []
+    index = 0
+    for gap_start, gap_end in gaps:
+        start = gap_start
+        while index < len(marks) and marks[index][0] < gap_end:
+            mark_start, mark_end = marks[index][0], marks[index][1]
+            if mark_start > start:
+                remaining.append((start, mark_start))
+            start = max(start, mark_end)
+            index += 1
+        if start < gap_end:
+            remaining.append((start, gap_end))
+    return remaining
+
+
+def _plain_html(text):
+    """ The html for a part of the text between two marks. A part with
+        only whitespace becomes one space (or newline), like the soup made it
+    """
+    if text and not text.strip():
+        return u"\n" if u"\n" in text else u" "
+    return escape(text)
+
+
+def annotate(text, resolver, found_systems):
+    """ Finds ships, urls and systems in the plain text of a message in one
+        go over the text. Entities (&amp;) are resolved first, tags are no
+        markup but text.
+        Returns the message as html and the parts of the text which are
+        not marked (they are the input for parse_status)
+    """
+    text = unescape(text)
+    gaps = [(0, len(text))]
+    marks = []
+    for finder in (find_ships, find_urls):
+        new_marks = finder(text, gaps)
+        gaps = _remaining_gaps(gaps, new_marks)
+        marks.extend(new_marks)
+    new_marks = find_systems(text, gaps, resolver, found_systems)
+    gaps = _remaining_gaps(gaps, new_marks)
+    marks.extend(new_marks)
+
+    parts = [u"<rtext>"]
+    position = 0
+    for start, end, html in sorted(marks):
+        parts.append(_plain_html(text[position:start]))
+        parts.append(html)
+        position = end
+    parts.append(_plain_html(text[position:]))
+    parts.append(u"</rtext>")
+    return u"".join(parts), [text[start:end] for start, end in gaps]
@@ -0,0 +1,115 @@
+###########################################################################
+#  Vintel - Visual Intel Chat Analyzer									  #
+#  Copyright (C) 2014-15 Sebastian Meyer (sparrow.242.de+eve@gmail.com )  #
+#																		  #
+#  This program is free software: you can redistribute it and/or modify	  #
+#  it under the terms of the GNU General Public License as published by	  #
+#  the Free Software Foundation, either version 3 of the License, or	  #
+#  (at your option) any later version.									  #
+#																		  #
+#  This program is distributed in the hope that it will be useful,		  #
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of		  #
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.	 See the		  #
+#  GNU General Public License for more details.							  #
+#																		  #
+#																		  #
+#  You should have received a copy of the GNU General Public License	  #
+#  along with this program.	 If not, see <http://www.gnu.org/licenses/>.  #
+###########################################################################
+
+""" Finding all ship names in a text in one pass (Aho-Corasick).
+    The automaton is built once from evegate.SHIPNAMES, so we don't need
+    to search the text again for every known ship.
+"""
+
+import vi.evegate as evegate
+
+
+class ShipMatcher(object):
+    """ Aho-Corasick automaton over a list of (upper case) ship names
+    """
+
+    def __init__(self, shipnames):
+        self._goto = [{}]  # node -> {char: node}
+        self._fail = [0]
+        self._out = [()]  # node -> lengths of the names ending here
+        for name in shipnames:
+            self._add(name)
+        self._build_fail_links()
+
+    def _add(self, name):
+        if not name:
+            return
+        node = 0
+        for char in name:
+            next_node = self._goto[node].get(char)
+            if next_node is None:
+                next_node = len(self._goto)
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append(())
+                self._goto[node][char] = next_node
+            node = next_node
+        if len(name) not in self._out[node]:
+            self._out[node] += (len(name),)
+
+    def _build_fail_links(self):
+        queue = list(self._goto[0].values())
+        for node in queue:
+            for char, child in self._goto[node].items():
+                fail = self._fail[node]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(char, 0)
+                self._out[child] += self._out[self._fail[child]]
+                queue.append(child)
+
+    def iter_matches(self, upper_text):
+        """ Yields (start, end) of every ship name in the text, overlapping
+            matches included
+        """
+        goto = self._goto
+        fail = self._fail
+        out = self._out
+        node = 0
+        for index, char in enumerate(upper_text):
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            for length in out[node]:
+                yield index + 1 - length, index + 1
+
+    def find_ships(self, upper_text):
+        """ Returns the (start, end) of the ship names in the text, which
+            stand alone. Before the name we accept a space or a X (like 2xRifter),
+            after it a space or a S (plural). Overlapping hits are solved by
+            taking the leftmost, than the longest one.
+        """
+        text_length = len(upper_text)
+        hits = []
+        for start, end in self.iter_matches(upper_text):
+            if start > 0 and upper_text[start - 1] not in (" ", "X"):
+                continue
+            if end < text_length - 1 and upper_text[end] not in ("S", " "):
+                continue
+            hits.append((start, end))
+        hits.sort(key=lambda hit: (hit[0], -hit[1]))
+        ships = []
+        last_end = 0
+        for start, end in hits:
+            if start >= last_end:
+                ships.append((start, end))
+                last_end = end
+        return ships
+
+
+_shipMatcher = None
+
+
+def ship_matcher():
+    """ The ShipMatcher for evegate.SHIPNAMES, built on first use
+    """
+    global _shipMatcher
+    if _shipMatcher is None:
+        _shipMatcher = ShipMatcher(evegate.SHIPNAMES)
+    return _shipMatcher
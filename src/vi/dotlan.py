@@ -21,19 +21,58 @@
 # Little lib and tool to get the map and information from dotlan		  #
 ###########################################################################
 
+import array
+import hashlib
+import json
 import logging
 import math
 import time
 
 import requests
 import six
-from bs4 import BeautifulSoup
 from vi import states
+from vi import svgdocument
 from vi.cache.cache import Cache
+from vi.resolver import SystemNameResolver
 
 from . import evegate
 
 
+# Applies the changes of the map to an already loaded map document,
+# {0} are the calls of the helpers below
+UPDATE_SCRIPT = u"""(function() {{
+function s(id, attrs, text) {{
+    var e = document.getElementById(id);
+    if (!e) return;
+    for (var k in attrs) e.setAttribute(k, attrs[k]);
+    if (text !== undefined) e.textContent = text;
+}}
+function l(id, attrs) {{
+    var e = document.getElementById(id);
+    if (!e) {{
+        var jumps = document.getElementById("jumps");
+        e = document.createElementNS("http://www.w3.org/2000/svg", "ellipse");
+        e.setAttribute("id", id);
+        jumps.insertBefore(e, jumps.firstChild);
+    }}
+    for (var k in attrs) e.setAttribute(k, attrs[k]);
+}}
+function r(id) {{
+    var e = document.getElementById(id);
+    if (e) e.parentNode.removeChild(e);
+}}
+function v(value) {{
+    var es = document.querySelectorAll(".statistics");
+    for (var i = 0; i < es.length; i++) es[i].setAttribute("visibility", value);
+}}
+{0}
+}})();"""
+
+
+def script_call(function, *args):
+    return u"{0}({1});".format(function, u", ".join(json.dumps(arg) for arg in args))
+
+
 class DotlanException(Exception):
     def __init__(self, *args, **kwargs):
         Exception.__init__(self, *args, **kwargs)
@@ -46,23 +85,84 @@ class Map(object):
 
     DOTLAN_BASIC_URL = u"http://evemaps.dotlan.net/svg/{0}.svg"
 
+    # The processed map is cached for every svg seen, bump the version if the processing changes
+    ARTEFACT_VERSION = 2
+    ARTEFACT_MAX_AGE = 60 * 60 * 24 * 30
+
     @property
     def svg(self):
-        # Re-render all systems
-        for system in self.systems.values():
-            system.update()
+        # Only serialize the document again if something on the map changed
+        self.update()
+        if self._content is None:
+            self._content = self.document.serialize()
+        return self._content
+
+    @property
+    def statisticsVisible(self):
+        return self._statisticsVisible
+
+    def update(self):
+        """ Ages the alarms of all systems and re-renders those whose color or timer changed,
+            returns True if the svg differs from the last rendered one
+        """
+        now = time.time()
+        for system, seconds, band in self.alarmStates.update(now):
+            if system.render_alarm(seconds, band):
+                self.changedSystems.add(system)
+                self._content = None
         # Update the marker
-        if not self.marker["opacity"] == "0":
-            now = time.time()
-            new_value = (1 - (now - float(self.marker["activated"])) / 10)
+        if not self.document.get(self.marker, "opacity") == "0":
+            new_value = (1 - (now - float(self.document.get(self.marker, "activated"))) / 10)
             if new_value < 0:
                 new_value = "0"
-            self.marker["opacity"] = new_value
-        content = str(self.soup)
-        return content
-
-    def __init__(self, region, svg_file=None):
+            self.document.set(self.marker, "opacity", new_value)
+            self._markerChanged = True
+            self._content = None
+        return self._content is None
+
+    def take_changes(self):
+        """ Brings the document up to date and returns what changed since the last call:
+            (the changed systems, True if the marker changed, True if the statistics were shown or hidden).
+            The changedParts of the systems are left to the caller.
+        """
+        self.update()
+        changes = (self.changedSystems, self._markerChanged, self._statisticsVisibilityChanged)
+        self.changedSystems = set()
+        self._markerChanged = False
+        self._statisticsVisibilityChanged = False
+        return changes
+
+    def update_script(self):
+        """ Brings the document up to date and returns the javascript to apply all changes
+            since the last call to a loaded map document, None if there are none
+        """
+        systems, marker_changed, statistics_changed = self.take_changes()
+        calls = []
+        for system in systems:
+            calls.extend(system.take_script_calls())
+        if marker_changed:
+            calls.append(script_call("s", "select_marker", {"transform": self.document.get(self.marker, "transform"),
+                                                            "opacity": self.document.get(self.marker, "opacity")}))
+        if statistics_changed:
+            calls.append(script_call("v", "visible" if self._statisticsVisible else "hidden"))
+        if not calls:
+            return None
+        return UPDATE_SCRIPT.format(u"\n".join(calls))
+
+    def discard_changes(self):
+        """ Forget the changes for update_script, e.g. if the map document is loaded from svg anyway
+        """
+        for system in self.changedSystems:
+            system.changedParts.clear()
+        self.changedSystems = set()
+        self._markerChanged = False
+        self._statisticsVisibilityChanged = False
+
+    def __init__(self, region, svg_file=None, backend=None):
+        """ backend = name of the svgdocument backend, the fastest available if None
+        """
         self.region = region
+        self.backend = svgdocument.backend_name(backend)
         cache = Cache()
         self.outdatedCacheError = None
 
@@ -86,73 +186,153 @@ class Map(object):
                         "without the map.\n\nRemember the site for possible " \
                         "updates: https://github.com/Xanthos-Eve/vintel".format(type(e), six.text_type(e))
                     raise DotlanException(t)
-        # Create soup from the svg
-        self.soup = BeautifulSoup(svg, 'html.parser')
-        self.systems = self._extract_systems_from_soup(self.soup)
+        self.alarmStates = AlarmStates()
+        self.changedSystems = set()
+        self._markerChanged = False
+        self._statisticsVisibilityChanged = False
+        self._content = None
+
+        # Processing the svg is expensive, use the prepared map if this svg was seen before
+        artefact_key = self._artefact_key(svg)
+        artefact = cache.get_fromcache(artefact_key)
+        self.systems = None
+        if artefact:
+            try:
+                self._load_artefact(artefact)
+            except Exception as e:
+                logging.error("Prepared map %s is not usable, processing the svg: %s", artefact_key, e)
+                self.systems = None
+        if self.systems is None:
+            self._process_svg(svg)
+            cache.put_into_cache(artefact_key, self._make_artefact(), self.ARTEFACT_MAX_AGE)
+        # The prepared svg without any intel, the static part of the map for a raster view
+        self.baseSvg = self._content
+        self.systemResolver = SystemNameResolver(self.systems)
+        # Direct references to the elements changed at runtime, no selects on the whole document
+        self.marker = self.elements["select_marker"]
+        self.statisticsElements = []
+        self.jumpDistances = JumpDistances(self.systems.values())
+        for system in self.systems.values():
+            system.connect_elements(self.elements)
+            system.jumpDistances = self.jumpDistances
+            system.changeListener = self._system_changed
+            if system.statisticsElement is not None:
+                self.statisticsElements.append(system.statisticsElement)
+        self._statisticsVisible = False
+
+    def _artefact_key(self, svg):
+        if isinstance(svg, six.text_type):
+            svg = svg.encode("utf-8")
+        return "map_prepared_{0}_{1}_{2}".format(self.region, self.backend, hashlib.sha1(svg).hexdigest())
+
+    def _process_svg(self, svg):
+        """ Parses the dotlan svg and prepares it for vintel
+        """
+        self.document = svgdocument.load_document(svg, self.backend)
+        self.systems = self._extract_systems(self.document)
         self.systemsById = {}
         for system in self.systems.values():
             self.systemsById[system.systemId] = system
-        self._prepare_svg(self.soup, self.systems)
+        self._prepare_svg(self.document, self.systems)
+        self.elements = self.document.elements_by_id()
         self._connect_neighbours()
-        self._statisticsVisible = False
-        self.marker = self.soup.select("#select_marker")[0]
 
-    def _extract_systems_from_soup(self, soup):
+    def _make_artefact(self):
+        """ Serializes the prepared svg and what was extracted from it
+        """
+        self._content = self.document.serialize()
+        systems = []
+        neighbours = []
+        for system in self.systems.values():
+            systems.append({"name": system.name, "id": system.systemId,
+                            "element": self.document.get(system.svgElement, "id"),
+                            "coordinates": system.mapCoordinates, "transform": system.transform})
+            for neighbour in system.get_neighbours():
+                if system.systemId < neighbour.systemId:
+                    neighbours.append((system.systemId, neighbour.systemId))
+        artefact = {"version": self.ARTEFACT_VERSION, "svg": self._content, "systems": systems,
+                    "neighbours": neighbours}
+        return json.dumps(artefact, separators=(",", ":"))
+
+    def _load_artefact(self, artefact):
+        """ Sets up the map from _make_artefact's output, skipping the processing of the svg
+        """
+        artefact = json.loads(artefact)
+        if artefact["version"] != self.ARTEFACT_VERSION:
+            raise DotlanException("version {0} is outdated".format(artefact["version"]))
+        self.document = svgdocument.load_document(artefact["svg"], self.backend)
+        self.elements = self.document.elements_by_id()
+        systems = {}
+        for data in artefact["systems"]:
+            systems[data["name"]] = System(data["name"], self.elements[data["element"]], self.document,
+                                           data["coordinates"], data["transform"], data["id"], self.alarmStates)
+        self.systemsById = {}
+        for system in systems.values():
+            self.systemsById[system.systemId] = system
+        for start_id, stop_id in artefact["neighbours"]:
+            self.systemsById[start_id].add_neighbour(self.systemsById[stop_id])
+        self.systems = systems
+        self._content = artefact["svg"]
+
+    def _extract_systems(self, document):
         systems = {}
         uses = {}
-        for use in soup.select("use"):
-            use_id = use["xlink:href"][1:]
+        for use in document.select("use"):
+            use_id = document.get(use, "xlink:href")[1:]
             uses[use_id] = use
-        symbols = soup.select("symbol")
+        symbols = document.select("symbol")
         for symbol in symbols:
-            symbol_id = symbol["id"]
+            symbol_id = document.get(symbol, "id")
             system_id = symbol_id[3:]
             try:
                 system_id = int(system_id)
             except ValueError as e:
                 continue
-            for element in symbol.select(".sys"):
-                name = element.select("text")[0].text.strip().upper()
+            for element in document.select(".sys", symbol):
+                name = document.text(document.select("text", element)[0]).strip().upper()
                 map_coordinates = {}
                 for keyname in ("x", "y", "width", "height"):
-                    map_coordinates[keyname] = float(uses[symbol_id][keyname])
+                    map_coordinates[keyname] = float(document.get(uses[symbol_id], keyname))
                 map_coordinates["center_x"] = (map_coordinates["x"] + (map_coordinates["width"] / 2))
                 map_coordinates["center_y"] = (map_coordinates["y"] + (map_coordinates["height"] / 2))
-                try:
-                    transform = uses[symbol_id]["transform"]
-                except KeyError:
-                    transform = "translate(0,0)"
-                systems[name] = System(name, element, self.soup, map_coordinates, transform, system_id)
+                transform = document.get(uses[symbol_id], "transform", "translate(0,0)")
+                systems[name] = System(name, element, document, map_coordinates, transform, system_id,
+                                       self.alarmStates)
         return systems
 
-    def _prepare_svg(self, soup, systems):
-        svg = soup.select("svg")[0]
+    def _prepare_svg(self, document, systems):
+        svg = document.root
         # Disable dotlan mouse functionality and make all jump lines black
-        svg["onmousedown"] = "return false;"
-        for line in soup.select("line"):
-            line["class"] = "j"
+        document.set(svg, "onmousedown", "return false;")
+        for line in document.select("line"):
+            document.set(line, "class", "j")
 
         # Current system marker ellipse
-        group = soup.new_tag("g", id="select_marker", opacity="0", activated="0", transform="translate(0, 0)")
-        ellipse = soup.new_tag("ellipse", cx="0", cy="0", rx="56", ry="28", style="fill:#462CFF")
-        group.append(ellipse)
+        group = document.new_element("g", {"id": "select_marker", "opacity": "0", "activated": "0",
+                                           "transform": "translate(0, 0)"})
+        ellipse = document.new_element("ellipse", {"cx": "0", "cy": "0", "rx": "56", "ry": "28",
+                                                   "style": "fill:#462CFF"})
+        document.append(group, ellipse)
 
         # The giant cross-hairs
         for coord in ((0, -10000), (-10000, 0), (10000, 0), (0, 10000)):
-            line = soup.new_tag("line", x1=coord[0], y1=coord[1], x2="0", y2="0", style="stroke:#462CFF")
-            group.append(line)
-        svg.insert(0, group)
+            line = document.new_element("line", {"x1": coord[0], "y1": coord[1], "x2": "0", "y2": "0",
+                                                 "style": "stroke:#462CFF"})
+            document.append(group, line)
+        document.insert(svg, 0, group)
 
         # Set up the tags for system statistics
         for systemId, system in self.systemsById.items():
             coords = system.mapCoordinates
             text = "stats n/a"
             style = "text-anchor:middle;font-size:8;font-weight:normal;font-family:Arial;"
-            svgtext = soup.new_tag("text", x=coords["center_x"], y=coords["y"] + coords["height"] + 6, fill="blue",
-                                   style=style, visibility="hidden", transform=system.transform)
-            svgtext["id"] = "stats_" + str(systemId)
-            svgtext["class"] = ["statistics", ]
-            svgtext.string = text
+            svgtext = document.new_element("text", {"x": coords["center_x"], "y": coords["y"] + coords["height"] + 6,
+                                                    "fill": "blue", "style": style, "visibility": "hidden",
+                                                    "transform": system.transform})
+            document.set(svgtext, "id", "stats_" + str(systemId))
+            document.set(svgtext, "class", "statistics")
+            document.set_text(svgtext, text)
+            document.append(svg, svgtext)
 
     def _connect_neighbours(self):
         """
@@ -160,8 +340,8 @@ class Map(object):
             It takes a look at all the jumps on the map and gets the system under
             which the line ends
         """
-        for jump in self.soup.select("#jumps")[0].select(".j"):
-            parts = jump["id"].split("-")
+        for jump in self.document.select(".j", self.elements["jumps"]):
+            parts = self.document.get(jump, "id").split("-")
             if parts[0] == "j":
                 start_system = self.systemsById[int(parts[1])]
                 stop_system = self.systemsById[int(parts[2])]
@@ -177,22 +357,30 @@ class Map(object):
         if statistics is not None:
             for systemId, system in self.systemsById.items():
                 if systemId in statistics:
-                    system.setStatistics(statistics[systemId])
+                    system.set_statistics(statistics[systemId])
         else:
             for system in self.systemsById.values():
-                system.setStatistics(None)
+                system.set_statistics(None)
         logging.info("add_system_statistics complete")
 
     def change_statistics_visibility(self):
         new_status = False if self._statisticsVisible else True
         value = "visible" if new_status else "hidden"
-        for line in self.soup.select(".statistics"):
-            line["visibility"] = value
+        for line in self.statisticsElements:
+            self.document.set(line, "visibility", value)
         self._statisticsVisible = new_status
+        self._statisticsVisibilityChanged = True
+        self._content = None
         return new_status
 
+    def _system_changed(self, system):
+        """ Called by a system whenever its part of the svg was modified
+        """
+        self._content = None
+        self.changedSystems.add(system)
+
     def debug_write_soup(self):
-        svg_data = self.soup.prettify("utf-8")
+        svg_data = self.document.serialize(pretty=True).encode("utf-8")
         try:
             with open("/Users/mark/Desktop/output.svg", "wb") as svgFile:
                 svgFile.write(svg_data)
@@ -201,6 +389,169 @@ class Map(object):
             logging.error(e)
 
 
+class JumpDistances(object):
+    """
+        The jump distances between all systems of a map, one row of the matrix
+        per system. Kept up to date when systems get connected or disconnected.
+    """
+
+    UNREACHABLE = 0xFFFF
+
+    def __init__(self, systems):
+        self.systems = list(systems)
+        self.index = dict((system, index) for index, system in enumerate(self.systems))
+        self.size = len(self.systems)
+        self.matrix = array.array("H", [self.UNREACHABLE]) * (self.size * self.size)
+        for system in self.systems:
+            self._update_distances_from(system)
+
+    def _update_distances_from(self, source):
+        """ Breadth first search from source, sets its row and (the jumps go both ways) its column
+        """
+        distances = {source: 0}
+        current = [source]
+        current_distance = 0
+        while current:
+            current_distance += 1
+            found = []
+            for system in current:
+                for neighbour in system._neighbours:
+                    if neighbour not in distances and neighbour in self.index:
+                        distances[neighbour] = current_distance
+                        found.append(neighbour)
+            current = found
+        size = self.size
+        matrix = self.matrix
+        row = self.index[source] * size
+        matrix[row:row + size] = array.array("H", [self.UNREACHABLE]) * size
+        for column in range(self.index[source], size * size, size):
+            matrix[column] = self.UNREACHABLE
+        for system, distance in distances.items():
+            index = self.index[system]
+            matrix[row + index] = distance
+            matrix[index * size + self.index[source]] = distance
+
+    def distance(self, start_system, stop_system):
+        """ Jumps from start to stop system, None if there is no route
+        """
+        distance = self.matrix[self.index[start_system] * self.size + self.index[stop_system]]
+        return None if distance == self.UNREACHABLE else distance
+
+    def neighbours(self, system, distance):
+        """ Same result as System.get_neighbours
+        """
+        row = self.index[system] * self.size
+        systems = {}
+        for index, system_distance in enumerate(self.matrix[row:row + self.size]):
+            if system_distance <= distance:
+                systems[self.systems[index]] = {"distance": system_distance}
+        return systems
+
+    def connected(self, first_system, second_system):
+        """ The jump between the systems is new, a shortest route uses it at most once
+        """
+        if first_system not in self.index or second_system not in self.index:
+            return
+        size = self.size
+        matrix = self.matrix
+        first_row = self.index[first_system] * size
+        second_row = self.index[second_system] * size
+        from_first = matrix[first_row:first_row + size]
+        from_second = matrix[second_row:second_row + size]
+        for start in range(size):
+            to_first = from_first[start]
+            to_second = from_second[start]
+            if to_first == self.UNREACHABLE and to_second == self.UNREACHABLE:
+                continue
+            row = start * size
+            for stop in range(size):
+                distance = min(to_first + 1 + from_second[stop], to_second + 1 + from_first[stop])
+                if distance < matrix[row + stop]:
+                    matrix[row + stop] = distance
+
+    def disconnected(self, first_system, second_system):
+        """ The jump between the systems is gone. Only the distances from systems with a
+            shortest route over the jump change: those one jump closer to one end than to the other
+        """
+        if first_system not in self.index or second_system not in self.index:
+            return
+        size = self.size
+        first_row = self.index[first_system] * size
+        second_row = self.index[second_system] * size
+        from_first = self.matrix[first_row:first_row + size]
+        from_second = self.matrix[second_row:second_row + size]
+        for index, system in enumerate(self.systems):
+            if abs(from_first[index] - from_second[index]) == 1:
+                self._update_distances_from(system)
+
+
+class AlarmStates(object):
+    """
+        The alarm state of systems in columns, a row per system: the status, the
+        alarm time, the alarm color band and the second the timer shows. update()
+        ages all running timers in one pass over the columns.
+    """
+
+    STATUSES = (states.UNKNOWN, states.ALARM, states.WAS_ALARMED, states.CLEAR, states.IGNORE, states.LOCATION)
+    NO_BAND = -1
+    NOT_SHOWN = -1
+
+    def __init__(self):
+        self.systems = []
+        self.status = array.array("b")
+        self.alarmTime = array.array("d")
+        self.band = array.array("b")
+        self.shown = array.array("d")
+        self.ticking = set()  # the rows with a running timer
+
+    def add(self, system):
+        """ Adds a row for the system, returns its index
+        """
+        self.systems.append(system)
+        self.status.append(self.STATUSES.index(states.UNKNOWN))
+        self.alarmTime.append(0.0)
+        self.band.append(self.NO_BAND)
+        self.shown.append(self.NOT_SHOWN)
+        return len(self.systems) - 1
+
+    def set_status(self, row, status):
+        """ The next update renders the color band and the timer of the row again
+        """
+        self.status[row] = self.STATUSES.index(status)
+        self.band[row] = self.NO_BAND
+        self.shown[row] = self.NOT_SHOWN
+        if status in System.TIMER_STATES:
+            self.ticking.add(row)
+        else:
+            self.ticking.discard(row)
+
+    def update(self, now):
+        """ Returns (system, seconds since the alarm, new color band or None) for all
+            systems whose timer second or color band changed since the last update
+        """
+        changed = []
+        status = self.status
+        alarm_time = self.alarmTime
+        bands = self.band
+        shown = self.shown
+        alarm = self.STATUSES.index(states.ALARM)
+        limits = [maxDiff for maxDiff, alarmColor, secondLineColor in System.ALARM_COLORS]
+        for row in self.ticking:
+            age = now - alarm_time[row]
+            seconds = math.floor(age)
+            new_band = None
+            if status[row] == alarm:
+                for band, limit in enumerate(limits):
+                    if age < limit:
+                        if band != bands[row]:
+                            bands[row] = new_band = band
+                        break
+            if seconds != shown[row] or new_band is not None:
+                shown[row] = seconds
+                changed.append((self.systems[row], int(seconds), new_band))
+        return changed
+
+
 class System(object):
     """
         A System on the Map
@@ -211,27 +562,69 @@ class System(object):
     ALARM_COLOR = ALARM_COLORS[0][1]
     UNKNOWN_COLOR = "#FFFFFF"
     CLEAR_COLOR = "#59FF6C"
+    TIMER_STATES = (states.ALARM, states.WAS_ALARMED, states.CLEAR)
 
-    def __init__(self, name, svg_element, map_soup, map_coordinates, transform, system_id):
-        self.status = states.UNKNOWN
+    def __init__(self, name, svg_element, document, map_coordinates, transform, system_id, alarm_states=None):
+        """ alarm_states = the AlarmStates of the map, the system has its own if None
+        """
+        self.alarmStates = alarm_states if alarm_states is not None else AlarmStates()
+        self.row = self.alarmStates.add(self)
         self.name = name
         self.svgElement = svg_element
-        self.mapSoup = map_soup
+        self.document = document
         self.origSvgElement = svg_element
-        self.rect = svg_element.select("rect")[0]
-        self.secondLine = svg_element.select("text")[1]
-        self.lastAlarmTime = 0
+        self.rect = document.select("rect", svg_element)[0]
+        self.secondLine = document.select("text", svg_element)[1]
+        # The rects that get the status color
+        self.rects = []
+        for rect in document.select("rect", svg_element):
+            classes = document.classes(rect)
+            if "location" not in classes and "marked" not in classes:
+                self.rects.append(rect)
+        # Elements outside of the system, see connect_elements
+        self.marker = None
+        self.jumpsElement = None
+        self.statisticsElement = None
+        # The elements changed by update_script and the prepared map must be found by id
+        if not document.get(svg_element, "id"):
+            document.set(svg_element, "id", name + u"_sys")
+        for index, rect in enumerate(document.select("rect", svg_element)):
+            if not document.get(rect, "id"):
+                document.set(rect, "id", u"{0}_rect{1}".format(name, index))
+        if not document.get(self.secondLine, "id"):
+            document.set(self.secondLine, "id", name + u"_txt")
         self.messages = []
+        self.changeListener = None
+        self.changedParts = set()
+        self._fillColor = None
+        self._locationElement = None
         self.set_status(states.UNKNOWN)
+        self.changedParts.clear()  # the initial status is part of the document
         self.__locatedCharacters = []
-        self.backgroundColor = "#FFFFFF"
         self.mapCoordinates = map_coordinates
         self.systemId = system_id
         self.transform = transform
         self.cachedOffsetPoint = None
         self._neighbours = set()
+        self.jumpDistances = None  # set by the map
         self.statistics = {"jumps": "?", "shipkills": "?", "factionkills": "?", "podkills": "?"}
 
+    @property
+    def status(self):
+        return self.alarmStates.STATUSES[self.alarmStates.status[self.row]]
+
+    @property
+    def lastAlarmTime(self):
+        return self.alarmStates.alarmTime[self.row]
+
+    def connect_elements(self, elements):
+        """ elements = the map's index of all elements by id
+        """
+        self.marker = elements["select_marker"]
+        self.jumpsElement = elements["jumps"]
+        self.statisticsElement = elements.get("stats_" + str(self.systemId))
+        self._locationElement = elements.get(self.name + u"_loc")
+
     def get_transform_offset_point(self):
         if not self.cachedOffsetPoint:
             if self.transform:
@@ -243,13 +636,14 @@ class System(object):
         return self.cachedOffsetPoint
 
     def mark(self):
-        marker = self.mapSoup.select("#select_marker")[0]
+        marker = self.marker
         offset_point = self.get_transform_offset_point()
         x = self.mapCoordinates["center_x"] + offset_point[0]
         y = self.mapCoordinates["center_y"] + offset_point[1]
-        marker["transform"] = "translate({x},{y})".format(x=x, y=y)
-        marker["opacity"] = "1"
-        marker["activated"] = time.time()
+        self.document.set(marker, "transform", "translate({x},{y})".format(x=x, y=y))
+        self.document.set(marker, "opacity", "1")
+        self.document.set(marker, "activated", time.time())
+        self._changed()
 
     def add_located_character(self, charname):
         id_name = self.name + u"_loc"
@@ -258,16 +652,56 @@ class System(object):
             self.__locatedCharacters.append(charname)
         if not was_located:
             coords = self.mapCoordinates
-            new_tag = self.mapSoup.new_tag("ellipse", cx=coords["center_x"] - 2.5, cy=coords["center_y"], id=id_name,
-                                           rx=coords["width"] / 2 + 4, ry=coords["height"] / 2 + 4, style="fill:#8b008d",
-                                           transform=self.transform)
-            jumps = self.mapSoup.select("#jumps")[0]
-            jumps.insert(0, new_tag)
+            new_tag = self.document.new_element("ellipse", {"cx": coords["center_x"] - 2.5, "cy": coords["center_y"],
+                                                            "id": id_name, "rx": coords["width"] / 2 + 4,
+                                                            "ry": coords["height"] / 2 + 4, "style": "fill:#8b008d",
+                                                            "transform": self.transform})
+            self.document.insert(self.jumpsElement, 0, new_tag)
+            self._locationElement = new_tag
+            self._changed("location")
 
     def set_background_color(self, color):
-        for rect in self.svgElement("rect"):
-            if "location" not in rect.get("class", []) and "marked" not in rect.get("class", []):
-                rect["style"] = "fill: {0};".format(color)
+        """ Returns True if the color differs from the current one
+        """
+        if color == self._fillColor:
+            return False
+        self._fillColor = color
+        for rect in self.rects:
+            self.document.set(rect, "style", "fill: {0};".format(color))
+        self.changedParts.add("background")
+        return True
+
+    def _changed(self, *parts):
+        self.changedParts.update(parts)
+        if self.changeListener is not None:
+            self.changeListener(self)
+
+    def take_script_calls(self):
+        """ Returns the update_script calls for the parts changed since the last call
+        """
+        calls = []
+        document = self.document
+        if "background" in self.changedParts:
+            for rect in self.rects:
+                calls.append(script_call("s", document.get(rect, "id"), {"style": document.get(rect, "style")}))
+        if "secondLine" in self.changedParts:
+            line = self.secondLine
+            attrs = {"class": document.get(line, "class", u""), "style": document.get(line, "style", u"")}
+            alarm_time = document.get(line, "alarmtime")
+            if alarm_time is not None:
+                attrs["alarmtime"] = alarm_time
+            calls.append(script_call("s", document.get(line, "id"), attrs, document.text(line)))
+        if "location" in self.changedParts:
+            id_name = self.name + u"_loc"
+            if self._locationElement is not None:
+                calls.append(script_call("l", id_name, document.attributes(self._locationElement)))
+            else:
+                calls.append(script_call("r", id_name))
+        if "statistics" in self.changedParts and self.statisticsElement is not None:
+            svgtext = self.statisticsElement
+            calls.append(script_call("s", document.get(svgtext, "id"), {}, document.text(svgtext)))
+        self.changedParts.clear()
+        return calls
 
     def get_located_characters(self):
         characters = []
@@ -276,13 +710,13 @@ class System(object):
         return characters
 
     def remove_located_character(self, charname):
-        id_name = self.name + u"_loc"
-
         if charname in self.__locatedCharacters:
             self.__locatedCharacters.remove(charname)
             if not self.__locatedCharacters:
-                for element in self.mapSoup.select("#" + id_name):
-                    element.decompose()
+                if self._locationElement is not None:
+                    self.document.remove(self._locationElement)
+                self._locationElement = None
+                self._changed("location")
 
     def add_neighbour(self, neighbour_system):
         """
@@ -291,6 +725,8 @@ class System(object):
         """
         self._neighbours.add(neighbour_system)
         neighbour_system._neighbours.add(self)
+        if self.jumpDistances is not None:
+            self.jumpDistances.connected(self, neighbour_system)
 
     def get_neighbours(self, distance=1):
         """
@@ -303,6 +739,8 @@ class System(object):
             example:
             {sys3: {"distance"}: 0, sys2: {"distance"}: 1}
         """
+        if self.jumpDistances is not None:
+            return self.jumpDistances.neighbours(self, distance)
         systems = {self: {"distance": 0}}
         current_distance = 0
         while current_distance < distance:
@@ -323,71 +761,76 @@ class System(object):
         if system in self._neighbours:
             self._neighbours.remove(system)
         if self in system._neighbours:
-            system._neigbours.remove(self)
+            system._neighbours.remove(self)
+        if self.jumpDistances is not None:
+            self.jumpDistances.disconnected(self, system)
 
-    def set_status(self, new_status):
+    def set_status(self, new_status, alarm_time=None):
+        """ alarm_time = when the alarm/clear happened (seconds since epoch), now if None
+        """
+        if alarm_time is None:
+            alarm_time = time.time()
+        document = self.document
+        if new_status in (states.ALARM, states.CLEAR):
+            self.alarmStates.alarmTime[self.row] = alarm_time
         if new_status == states.ALARM:
-            self.lastAlarmTime = time.time()
-            if "stopwatch" not in self.secondLine["class"]:
-                self.secondLine["class"].append("stopwatch")
-            self.secondLine["alarmtime"] = self.lastAlarmTime
-            self.secondLine["style"] = "fill: #FFFFFF;"
+            document.add_class(self.secondLine, "stopwatch")
+            document.set(self.secondLine, "alarmtime", self.lastAlarmTime)
+            document.set(self.secondLine, "style", "fill: #FFFFFF;")
             self.set_background_color(self.ALARM_COLOR)
         elif new_status == states.CLEAR:
-            self.lastAlarmTime = time.time()
             self.set_background_color(self.CLEAR_COLOR)
-            self.secondLine["alarmtime"] = 0
-            if "stopwatch" not in self.secondLine["class"]:
-                self.secondLine["class"].append("stopwatch")
-            self.secondLine["alarmtime"] = self.lastAlarmTime
-            self.secondLine["style"] = "fill: #000000;"
-            self.secondLine.string = "clear"
+            document.add_class(self.secondLine, "stopwatch")
+            document.set(self.secondLine, "alarmtime", self.lastAlarmTime)
+            document.set(self.secondLine, "style", "fill: #000000;")
+            document.set_text(self.secondLine, "clear")
         elif new_status == states.WAS_ALARMED:
             self.set_background_color(self.UNKNOWN_COLOR)
-            self.secondLine["style"] = "fill: #000000;"
+            document.set(self.secondLine, "style", "fill: #000000;")
         elif new_status == states.UNKNOWN:
             self.set_background_color(self.UNKNOWN_COLOR)
             # second line in the rects is reserved for the clock
-            self.secondLine.string = "?"
-            self.secondLine["style"] = "fill: #000000;"
+            document.set_text(self.secondLine, "?")
+            document.set(self.secondLine, "style", "fill: #000000;")
         if new_status not in (states.NOT_CHANGE, states.REQUEST):  # unknown not affect system status
-            self.status = new_status
+            self.alarmStates.set_status(self.row, new_status)
+            self._changed("background", "secondLine")
 
     def set_statistics(self, statistics):
         if statistics is None:
             text = "stats n/a"
         else:
             text = "j-{jumps} f-{factionkills} s-{shipkills} p-{podkills}".format(**statistics)
-        svgtext = self.mapSoup.select("#stats_" + str(self.systemId))[0]
-        svgtext.string = text
+        self.document.set_text(self.statisticsElement, text)
+        self._changed("statistics")
 
-    def update(self):
-        # state changed?
-        if self.status == states.ALARM:
-            alarm_time = time.time() - self.lastAlarmTime
-            for maxDiff, alarmColor, secondLineColor in self.ALARM_COLORS:
-                if alarm_time < maxDiff:
-                    if self.backgroundColor != alarmColor:
-                        self.backgroundColor = alarmColor
-                        for rect in self.svgElement("rect"):
-                            if "location" not in rect.get("class", []) and "marked" not in rect.get("class", []):
-                                rect["style"] = "fill: {0};".format(self.backgroundColor)
-                        self.secondLine["style"] = "fill: {0};".format(secondLineColor)
-                    break
-        if self.status in (states.ALARM, states.WAS_ALARMED, states.CLEAR):  # timer
-            diff = math.floor(time.time() - self.lastAlarmTime)
-            minutes = int(math.floor(diff / 60))
-            seconds = int(diff - minutes * 60)
-            string = "{m:02d}:{s:02d}".format(m=minutes, s=seconds)
-            if self.status == states.CLEAR:
-                seconds_until_white = 10 * 60
-                calc_value = int(diff / (seconds_until_white / 255.0))
-                if calc_value > 255:
-                    calc_value = 255
-                    self.secondLine["style"] = "fill: #008100;"
-                string = "clr: {m:02d}:{s:02d}".format(m=minutes, s=seconds)
-                self.set_background_color("rgb({r},{g},{b})".format(r=calc_value, g=255, b=calc_value))
-            self.secondLine.string = string
+    def render_alarm(self, seconds, band):
+        """ Writes the timer (seconds since the alarm) and the alarm color band, if not None,
+            to the svg, returns True if the svg changed
+        """
+        changed = False
+        if band is not None:
+            maxDiff, alarmColor, secondLineColor = self.ALARM_COLORS[band]
+            self.set_background_color(alarmColor)
+            self.document.set(self.secondLine, "style", "fill: {0};".format(secondLineColor))
+            self.changedParts.add("secondLine")
+            changed = True
+        minutes = seconds // 60
+        string = "{m:02d}:{s:02d}".format(m=minutes, s=seconds - minutes * 60)
+        if self.status == states.CLEAR:
+            seconds_until_white = 10 * 60
+            calc_value = int(seconds / (seconds_until_white / 255.0))
+            if calc_value > 255:
+                calc_value = 255
+                self.document.set(self.secondLine, "style", "fill: #008100;")
+            string = "clr: " + string
+            if self.set_background_color("rgb({r},{g},{b})".format(r=calc_value, g=255, b=calc_value)):
+                changed = True
+        if self.document.text(self.secondLine) != string:
+            self.document.set_text(self.secondLine, string)
+            self.changedParts.add("secondLine")
+            changed = True
+        return changed
 
 
 def convert_region_name(name):
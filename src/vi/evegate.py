@@ -17,9 +17,43 @@
 #  along with this program.	 If not, see <http://www.gnu.org/licenses/>.  #
 ###########################################################################
 
+import calendar
 import datetime
 import time
 
+# The names of all ships in upper case, the chatparser looks for them in the messages
+SHIPNAMES = ("ABADDON", "ABSOLUTION", "AEON", "ALGOS", "AMARR SHUTTLE", "ANATHEMA", "ANSHAR", "APOCALYPSE",
+             "APOCALYPSE IMPERIAL ISSUE", "APOCALYPSE NAVY ISSUE", "APOSTLE", "APOTHEOSIS", "ARAZU", "ARBITRATOR",
+             "ARCHON", "ARES", "ARK", "ARMAGEDDON", "ARMAGEDDON NAVY ISSUE", "ASHIMMU", "ASTARTE", "ASTERO", "ATRON",
+             "AUGOROR", "AUGOROR NAVY ISSUE", "AVATAR", "BADGER", "BANTAM", "BARGHEST", "BASILISK", "BESTOWER",
+             "BHAALGORN", "BIFROST", "BLACKBIRD", "BROADSWORD", "BRUTIX", "BRUTIX NAVY ISSUE", "BURST", "BUSTARD",
+             "BUZZARD", "CALDARI NAVY HOOKBILL", "CALDARI SHUTTLE", "CARACAL", "CARACAL NAVY ISSUE", "CATALYST",
+             "CELESTIS", "CERBERUS", "CHARON", "CHEETAH", "CHIMERA", "CLAW", "CLAYMORE", "COERCER", "COMET", "CONDOR",
+             "CONFESSOR", "CORAX", "CORMORANT", "COVETOR", "CRANE", "CROW", "CRUCIFIER", "CRUOR", "CRUSADER", "CURSE",
+             "CYCLONE", "CYNABAL", "DAMNATION", "DAREDEVIL", "DEIMOS", "DEVOTER", "DOMINIX", "DOMINIX NAVY ISSUE",
+             "DRAGOON", "DRAKE", "DRAKE NAVY ISSUE", "DRAMIEL", "EAGLE", "ENYO", "EOS", "EPITHAL", "ERIS",
+             "EXECUTIONER", "EXEQUROR", "EXEQUROR NAVY ISSUE", "FALCON", "FEDERATION NAVY COMET", "FENRIR", "FEROX",
+             "FLYCATCHER", "FREKI", "GALLENTE SHUTTLE", "GARMUR", "GILA", "GNOSIS", "GOLD MAGNATE", "GOLEM",
+             "GRIFFIN", "GUARDIAN", "HARBINGER", "HARBINGER NAVY ISSUE", "HARPY", "HAWK", "HEL", "HELIOS", "HERETIC",
+             "HERON", "HOARDER", "HOUND", "HUGINN", "HULK", "HURRICANE", "HURRICANE FLEET ISSUE", "HYENA", "HYPERION",
+             "IMICUS", "IMPAIROR", "IMPEL", "IMPERIAL NAVY SLICER", "INCURSUS", "INQUISITOR", "ISHKUR", "ISHTAR",
+             "ITERON", "JACKDAW", "JAGUAR", "KERES", "KESTREL", "KITSUNE", "KRAKEN", "KRONOS", "LACHESIS", "LEGION",
+             "LEVIATHAN", "LOKI", "MACHARIEL", "MACKINAW", "MAELSTROM", "MAGNATE", "MALEDICTION", "MALLER", "MAMMOTH",
+             "MANTICORE", "MAULUS", "MEGATHRON", "MEGATHRON NAVY ISSUE", "MERLIN", "MINMATAR SHUTTLE", "MOA", "MOROS",
+             "MUNINN", "MYRMIDON", "NAGLFAR", "NAVITAS", "NEMESIS", "NESTOR", "NIDHOGGUR", "NIGHTHAWK", "NIGHTMARE",
+             "NOMAD", "NYX", "OBELISK", "OCCATOR", "OMEN", "OMEN NAVY ISSUE", "ONEIROS", "ONYX", "ORACLE", "ORCA",
+             "ORTHRUS", "OSPREY", "OSPREY NAVY ISSUE", "PALADIN", "PANTHER", "PHANTASM", "PHOBOS", "PHOENIX",
+             "PILGRIM", "POLICE PURSUIT COMET", "PROBE", "PROCURER", "PROPHECY", "PROROK", "PROTEUS", "PROVIDENCE",
+             "PUNISHER", "PURIFIER", "RAGNAROK", "RAPIER", "RATTLESNAKE", "RAVEN", "RAVEN NAVY ISSUE", "REAPER",
+             "REDEEMER", "REPUBLIC FLEET FIRETAIL", "RETRIBUTION", "RETRIEVER", "REVELATION", "RHEA", "RIFTER",
+             "ROKH", "ROOK", "RORQUAL", "RUPTURE", "SABRE", "SACRILEGE", "SCIMITAR", "SCORPION",
+             "SCORPION NAVY ISSUE", "SCYTHE", "SCYTHE FLEET ISSUE", "SENTINEL", "SIGIL", "SILVER MAGNATE", "SKIFF",
+             "SLASHER", "SLEIPNIR", "SPECTER", "STABBER", "STABBER FLEET ISSUE", "STILETTO", "STORK", "STRATIOS",
+             "SUCCUBUS", "SVIPUL", "TALOS", "TALWAR", "TARANIS", "TEMPEST", "TEMPEST FLEET ISSUE", "TENGU",
+             "THANATOS", "THORAX", "THRASHER", "TORMENTOR", "TRISTAN", "TYPHOON", "TYPHOON FLEET ISSUE", "VAGABOND",
+             "VARGUR", "VELATOR", "VENGEANCE", "VENTURE", "VEXOR", "VEXOR NAVY ISSUE", "VIATOR", "VIGIL", "VIGILANT",
+             "VINDICATOR", "VISITANT", "VULTURE", "WIDOW", "WOLF", "WORM", "WREATH", "WYVERN", "ZEALOT")
+
 
 def current_eve_time():
     """ Returns the current eve-time as a datetime.datetime
@@ -33,6 +67,12 @@ def eve_epoch():
     return time.mktime(datetime.datetime.utcnow().timetuple())
 
 
+def eve_time_to_epoch(eve_time):
+    """ Converts a eve-time (datetime.datetime) to seconds since epoch
+    """
+    return calendar.timegm(eve_time.timetuple())
+
+
 def seconds_till_downtime():
     """ Return the seconds till the next downtime"""
     now = current_eve_time()
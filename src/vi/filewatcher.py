@@ -17,12 +17,23 @@
 #  along with this program.	 If not, see <http://www.gnu.org/licenses/>.  #
 ###########################################################################
 
+import ctypes
+import ctypes.util
+import datetime
+import errno
+import logging
 import os
+import select
 import stat
+import struct
+import sys
 import time
 
+import six
 from PyQt4 import QtCore
 from PyQt4.QtCore import SIGNAL
+from vi import evegate
+from vi.chatparser.chatparser import split_log_filename
 
 """
 There is a problem with the QFIleWatcher on Windows and the log
@@ -33,10 +44,100 @@ the watched directory another event there, which tirggers the OS to
 reread the files informations, trigger the QFileWatcher.
 So here is a workaround implementation.
 We use here also a QFileWatcher, only to the directory. It will notify it
-if a new file was created. We watch only the newest (last 24h), not all!
+if a new file was created. We watch only the newest (last 24h), not all! The files
+of every room, because any room may carry "xxx" KOS requests. EVE puts the room and the creation time into
+the filename, so we know this without a stat and only have to look at the
+new names when the directory changed.
+To find the changed files the thread uses a backend: on Linux the kernel
+tells us about writes (inotify), everywhere else we stat the files every
+POLL_INTERVAL seconds.
 """
 
 DEFAULT_MAX_AGE = 60 * 60 * 24
+POLL_INTERVAL = 0.5
+
+
+class PollingBackend(object):
+    """ No events from the OS, so every file could have changed
+    """
+
+    def wait_for_changes(self, paths):
+        time.sleep(POLL_INTERVAL)
+        return list(paths)
+
+    def close(self):
+        pass
+
+
+class InotifyBackend(object):
+    """ Gets the changed files of the directory from inotify (Linux only).
+        We use the syscalls through ctypes, so no extra package is needed.
+    """
+
+    IN_MODIFY = 0x00000002
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_Q_OVERFLOW = 0x00004000
+    IN_NONBLOCK = os.O_NONBLOCK
+    IN_CLOEXEC = 0o2000000
+    WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+
+    _EVENT = struct.Struct("iIII")  # wd, mask, cookie, len (of the name following)
+
+    def __init__(self, path):
+        self.path = path
+        self._encoding = sys.getfilesystemencoding() or "utf-8"
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self._fd = libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        path_bytes = path.encode(self._encoding) if isinstance(path, six.text_type) else path
+        if libc.inotify_add_watch(self._fd, path_bytes, self.WATCH_MASK) < 0:
+            error = ctypes.get_errno()
+            os.close(self._fd)
+            raise OSError(error, "inotify_add_watch failed for {0}".format(path))
+
+    def wait_for_changes(self, paths):
+        if not select.select([self._fd], [], [], POLL_INTERVAL)[0]:
+            return []
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except OSError as e:
+            if e.errno in (errno.EAGAIN, errno.EINTR):
+                return []
+            raise
+        changed = set()
+        offset = 0
+        while offset + self._EVENT.size <= len(data):
+            wd, mask, cookie, length = self._EVENT.unpack_from(data, offset)
+            offset += self._EVENT.size
+            name = data[offset:offset + length].rstrip(b"\0")
+            offset += length
+            if mask & self.IN_Q_OVERFLOW:
+                # we lost events, so every file could have changed
+                return list(paths)
+            if name:
+                if isinstance(self.path, six.text_type):
+                    name = name.decode(self._encoding, "replace")
+                changed.add(os.path.join(self.path, name))
+        return [path for path in paths if path in changed]
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+
+def create_backend(path):
+    """ inotify on Linux, polling everywhere else or if inotify fails
+    """
+    if sys.platform.startswith("linux"):
+        try:
+            return InotifyBackend(path)
+        except Exception as e:
+            logging.warning("inotify not available, polling the chatlogs: %s", e)
+    return PollingBackend()
 
 
 class FileWatcher(QtCore.QThread):
@@ -45,7 +146,9 @@ class FileWatcher(QtCore.QThread):
         self.path = path
         self.maxAge = max_age
         self.files = {}
+        self.entries = {}  # filename: (roomname, created) for all names in the directory
         self.updatewatchedfiles()
+        self.backend = create_backend(path)
         self.qtfw = QtCore.QFileSystemWatcher()
         self.qtfw.directoryChanged.connect(self.directory_changed)
         self.qtfw.addPath(path)
@@ -56,35 +159,69 @@ class FileWatcher(QtCore.QThread):
         self.updatewatchedfiles()
 
     def run(self):
+        check_all = True  # after start and pause we have to look at every file
+        indexed = None  # the index (self.files) looked at last, it is replaced when files come or go
         while True:
-            time.sleep(0.5)
+            changed = self.backend.wait_for_changes(self.files)
             if not self.active:
+                self.backend.close()
                 return
             if self.paused:
+                check_all = True
                 continue
-            for path, modified in self.files.items():
-                pathstat = os.stat(path)
+            files = self.files
+            if check_all:
+                changed = list(files)
+                check_all = False
+            elif files is not indexed:
+                # The events of a new file may have come before it was indexed (GUI thread)
+                changed = set(changed).union(path for path in files if path not in indexed)
+            indexed = files
+            for path in changed:
+                modified = files.get(path)
+                if modified is None:
+                    continue
+                try:
+                    pathstat = os.stat(path)
+                except OSError:
+                    continue
                 if not stat.S_ISREG(pathstat.st_mode):
                     continue
                 if modified < pathstat.st_size:
                     self.emit(SIGNAL("file_change"), path)
-                self.files[path] = pathstat.st_size
+                files[path] = pathstat.st_size
 
     def quit(self):
         self.active = False
         QtCore.QThread.quit(self)
 
     def updatewatchedfiles(self):
-        # Reading all files from the directory
-        now = time.time()
-        path = self.path
-        files_in_dir = {}
-        for f in os.listdir(path):
-            fullpath = os.path.join(path, f)
-            pathstat = os.stat(fullpath)
-            if not stat.S_ISREG(pathstat.st_mode):
-                continue
-            if self.maxAge and ((now - pathstat.st_mtime) > self.maxAge):
-                continue
-            files_in_dir[fullpath] = self.files.get(fullpath, 0)
-        self.files = files_in_dir
+        # Only the names we don't know yet are new files
+        names = set(os.listdir(self.path))
+        files = dict(self.files)
+        for filename in names.difference(self.entries):
+            entry = split_log_filename(filename)
+            self.entries[filename] = entry
+            if self._is_wanted(entry):
+                files[os.path.join(self.path, filename)] = 0
+        for filename in set(self.entries).difference(names):
+            del self.entries[filename]
+            files.pop(os.path.join(self.path, filename), None)
+        self.files = self._without_expired(files)
+
+    def _is_wanted(self, entry):
+        if entry is None:
+            return False  # not a chatlog
+        return not self.maxAge or entry[1] >= self._oldest_creation_time()
+
+    def _oldest_creation_time(self):
+        return evegate.current_eve_time() - datetime.timedelta(seconds=self.maxAge)
+
+    def _without_expired(self, files):
+        if not self.maxAge:
+            return files
+        oldest = self._oldest_creation_time()
+        for fullpath in list(files):
+            if self.entries[os.path.basename(fullpath)][1] < oldest:
+                del files[fullpath]
+        return files
@@ -0,0 +1,96 @@
+###########################################################################
+#  Vintel - Visual Intel Chat Analyzer									  #
+#  Copyright (C) 2014-15 Sebastian Meyer (sparrow.242.de+eve@gmail.com )  #
+#																		  #
+#  This program is free software: you can redistribute it and/or modify	  #
+#  it under the terms of the GNU General Public License as published by	  #
+#  the Free Software Foundation, either version 3 of the License, or	  #
+#  (at your option) any later version.									  #
+#																		  #
+#  This program is distributed in the hope that it will be useful,		  #
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of		  #
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.	 See the		  #
+#  GNU General Public License for more details.							  #
+#																		  #
+#																		  #
+#  You should have received a copy of the GNU General Public License	  #
+#  along with this program.	 If not, see <http://www.gnu.org/licenses/>.  #
+###########################################################################
+
+""" Resolving the words of a chat message to system names.
+    The index is built once per map, so the parser needs no scan over all
+    system names for every word of every message.
+"""
+
+# only words with less than this chars are checked as begin of a name
+MAX_PREFIX_LENGTH = 4
+
+
+class PrefixTrie(object):
+    """ Remembers for every prefix of the inserted keys the first value
+        that was inserted below it
+    """
+
+    _VALUE = None  # chars are never None, so we use it as key for the value
+
+    def __init__(self, max_depth=None):
+        self.maxDepth = max_depth
+        self._root = {}
+
+    def insert(self, key, value):
+        node = self._root
+        for char in key[:self.maxDepth]:
+            node = node.setdefault(char, {})
+            node.setdefault(self._VALUE, value)
+
+    def first(self, prefix):
+        """ The value of the first inserted key beginning with prefix (or None)
+        """
+        node = self._root
+        for char in prefix:
+            node = node.get(char)
+            if node is None:
+                return None
+        return node.get(self._VALUE)
+
+
+class SystemNameResolver(object):
+    """ Finds the system a (upper case) word is about. The rules and their
+        precedence are those the parser used since ever:
+            - direct hit on the name
+            - words with 2-4 chars: the name begins with the word
+            - words with a minus: I-IF will match I43-IF3
+            - else: the name without the minus begins with the word
+                    (F-YH58 is named FY)
+        If more than one system matches, the first in the order of the
+        systems dict wins.
+    """
+
+    def __init__(self, systems):
+        """ systems = the known systems as dict name: system
+        """
+        self.systems = systems
+        self._prefixes = PrefixTrie(MAX_PREFIX_LENGTH)
+        self._dashInitials = {}
+        self._strippedPrefixes = PrefixTrie()
+        for name in systems.keys():
+            self._prefixes.insert(name, name)
+            self._strippedPrefixes.insert(name.replace("-", ""), name)
+            parts = name.split("-")
+            if len(parts) == 2 and len(parts[0]) > 1 and len(parts[1]) > 1:
+                self._dashInitials.setdefault((parts[0][0], parts[1][0]), name)
+
+    def resolve(self, upper_word):
+        """ Returns the name of the system the word is about, or None
+        """
+        if upper_word in self.systems:
+            return upper_word
+        elif 1 < len(upper_word) <= MAX_PREFIX_LENGTH:
+            return self._prefixes.first(upper_word)
+        elif "-" in upper_word and len(upper_word) > 2:
+            parts = upper_word.split("-")
+            if len(parts) == 2 and len(parts[0]) > 1 and len(parts[1]) > 1:
+                return self._dashInitials.get((parts[0][0], parts[1][0]))
+        elif len(upper_word) > 1:
+            return self._strippedPrefixes.first(upper_word)
+        return None
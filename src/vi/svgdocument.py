@@ -0,0 +1,268 @@
+###########################################################################
+#  Vintel - Visual Intel Chat Analyzer									  #
+#  Copyright (C) 2014-15 Sebastian Meyer (sparrow.242.de+eve@gmail.com )  #
+#																		  #
+#  This program is free software: you can redistribute it and/or modify	  #
+#  it under the terms of the GNU General Public License as published by	  #
+#  the Free Software Foundation, either version 3 of the License, or	  #
+#  (at your option) any later version.									  #
+#																		  #
+#  This program is distributed in the hope that it will be useful,		  #
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of		  #
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.	 See the		  #
+#  GNU General Public License for more details.							  #
+#																		  #
+#																		  #
+#  You should have received a copy of the GNU General Public License	  #
+#  along with this program.	 If not, see <http://www.gnu.org/licenses/>.  #
+###########################################################################
+
+""" The map svg behind a small interface with two backends: lxml, if it is
+    installed, and BeautifulSoup's html.parser. Elements are the native ones
+    of the backend and are only handled through the methods of the document.
+    Selectors are single simple css selectors: "tag", ".class", "#id" or "*".
+"""
+
+import logging
+
+import six
+from bs4 import BeautifulSoup
+
+try:
+    from lxml import etree
+except ImportError:
+    etree = None
+
+NAMESPACES = {"xlink": "http://www.w3.org/1999/xlink", "xml": "http://www.w3.org/XML/1998/namespace"}
+
+
+class SoupDocument(object):
+    """ BeautifulSoup with the html.parser, the pure python fallback
+    """
+
+    name = "bs4"
+
+    def __init__(self, svg):
+        self.soup = BeautifulSoup(svg, "html.parser")
+        self.root = self.soup.find("svg")
+
+    def select(self, selector, element=None):
+        """ Returns all elements below element (the whole document if None) matching the selector
+        """
+        return (self.soup if element is None else element).select(selector)
+
+    def elements_by_id(self):
+        elements = {}
+        for element in self.soup.find_all(id=True):
+            elements.setdefault(element["id"], element)
+        return elements
+
+    def tag(self, element):
+        return element.name
+
+    def get(self, element, name, default=None):
+        value = element.get(name, default)
+        if isinstance(value, list):
+            value = u" ".join(value)
+        return value
+
+    def set(self, element, name, value):
+        element[name] = six.text_type(value)
+
+    def delete(self, element, name):
+        if name in element.attrs:
+            del element.attrs[name]
+
+    def attributes(self, element):
+        attributes = {}
+        for name in element.attrs:
+            attributes[name] = self.get(element, name)
+        return attributes
+
+    def classes(self, element):
+        value = element.get("class", [])
+        if isinstance(value, list):
+            return list(value)
+        return value.split()
+
+    def add_class(self, element, name):
+        classes = self.classes(element)
+        if name not in classes:
+            classes.append(name)
+            element["class"] = classes
+
+    def text(self, element):
+        return element.text
+
+    def set_text(self, element, text):
+        element.string = text
+
+    def new_element(self, tag, attributes):
+        element = self.soup.new_tag(tag)
+        for name, value in attributes.items():
+            self.set(element, name, value)
+        return element
+
+    def insert(self, parent, index, element):
+        parent.insert(index, element)
+
+    def append(self, parent, element):
+        parent.append(element)
+
+    def remove(self, element):
+        element.decompose()
+
+    def serialize(self, pretty=False):
+        if pretty:
+            return self.soup.prettify()
+        return six.text_type(self.soup)
+
+
+class EtreeDocument(object):
+    """ lxml's etree with its xml parser, much faster than the soup
+    """
+
+    name = "lxml"
+
+    TAG_MATCH = "{*}"
+    ID_XPATH = "[@id=$value]"
+    CLASS_XPATH = "[contains(concat(' ', normalize-space(@class), ' '), concat(' ', $value, ' '))]"
+
+    def __init__(self, svg):
+        if isinstance(svg, six.text_type):
+            svg = svg.encode("utf-8")
+        parser = etree.XMLParser(huge_tree=True)
+        self.root = etree.fromstring(svg, parser)
+        self.namespace = etree.QName(self.root).namespace
+        self._xpaths = {}
+        for axis in ("descendant-or-self", "descendant"):
+            self._xpaths[axis, "#"] = etree.XPath(axis + "::*" + self.ID_XPATH)
+            self._xpaths[axis, "."] = etree.XPath(axis + "::*" + self.CLASS_XPATH)
+
+    def select(self, selector, element=None):
+        """ Returns all elements below element (the whole document if None) matching the selector
+        """
+        if element is None:
+            node, axis = self.root, "descendant-or-self"
+        else:
+            node, axis = element, "descendant"
+        kind = selector[0]
+        if kind in ("#", "."):
+            return self._xpaths[axis, kind](node, value=selector[1:])
+        tag = etree.Element if selector == "*" else self.TAG_MATCH + selector
+        if element is None:
+            return list(node.iter(tag))
+        return list(node.iterdescendants(tag))
+
+    def elements_by_id(self):
+        elements = {}
+        for element in self.root.iter(etree.Element):
+            element_id = element.get("id")
+            if element_id is not None:
+                elements.setdefault(element_id, element)
+        return elements
+
+    def tag(self, element):
+        return etree.QName(element).localname
+
+    def _name(self, name):
+        if ":" in name:
+            prefix, localname = name.split(":", 1)
+            if prefix in NAMESPACES:
+                return "{{{0}}}{1}".format(NAMESPACES[prefix], localname)
+        return name
+
+    def get(self, element, name, default=None):
+        return element.get(self._name(name), default)
+
+    def set(self, element, name, value):
+        element.set(self._name(name), six.text_type(value))
+
+    def delete(self, element, name):
+        element.attrib.pop(self._name(name), None)
+
+    def attributes(self, element):
+        prefixes = dict((uri, prefix) for prefix, uri in NAMESPACES.items())
+        attributes = {}
+        for name, value in element.attrib.items():
+            qname = etree.QName(name)
+            if qname.namespace in prefixes:
+                name = u"{0}:{1}".format(prefixes[qname.namespace], qname.localname)
+            attributes[name] = value
+        return attributes
+
+    def classes(self, element):
+        return element.get("class", "").split()
+
+    def add_class(self, element, name):
+        classes = self.classes(element)
+        if name not in classes:
+            classes.append(name)
+            element.set("class", u" ".join(classes))
+
+    def text(self, element):
+        return u"".join(element.itertext())
+
+    def set_text(self, element, text):
+        for child in list(element):
+            element.remove(child)
+        element.text = text
+
+    def new_element(self, tag, attributes):
+        if self.namespace:
+            tag = "{{{0}}}{1}".format(self.namespace, tag)
+        element = etree.Element(tag)
+        for name, value in attributes.items():
+            self.set(element, name, value)
+        return element
+
+    def insert(self, parent, index, element):
+        parent.insert(index, element)
+
+    def append(self, parent, element):
+        parent.append(element)
+
+    def remove(self, element):
+        # Keep the text following the element, etree would remove it with the element
+        parent = element.getparent()
+        if element.tail:
+            previous = element.getprevious()
+            if previous is not None:
+                previous.tail = (previous.tail or u"") + element.tail
+            else:
+                parent.text = (parent.text or u"") + element.tail
+        parent.remove(element)
+
+    def serialize(self, pretty=False):
+        return etree.tostring(self.root, encoding=six.text_type, pretty_print=pretty)
+
+
+BACKENDS = {SoupDocument.name: SoupDocument}
+if etree is not None:
+    BACKENDS[EtreeDocument.name] = EtreeDocument
+DEFAULT_BACKEND = EtreeDocument.name if etree is not None else SoupDocument.name
+
+
+def backend_name(backend=None):
+    """ The name of the backend load_document uses for backend
+    """
+    if backend is None:
+        return DEFAULT_BACKEND
+    if backend not in BACKENDS:
+        logging.warning("svg backend %s is not available, using %s", backend, DEFAULT_BACKEND)
+        return DEFAULT_BACKEND
+    return backend
+
+
+def load_document(svg, backend=None):
+    """ Parses the svg (text or bytes) with the backend (by name), the fastest available if None.
+        An svg that is not well-formed xml is left to the soup, which tolerates it.
+    """
+    document_class = BACKENDS[backend_name(backend)]
+    if document_class is EtreeDocument:
+        try:
+            return EtreeDocument(svg)
+        except etree.XMLSyntaxError as e:
+            logging.warning("The svg is not well-formed xml, parsing it with %s: %s", SoupDocument.name, e)
+            return SoupDocument(svg)
+    return document_class(svg)
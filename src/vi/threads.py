@@ -0,0 +1,95 @@
+###########################################################################
+#  Vintel - Visual Intel Chat Analyzer									  #
+#  Copyright (C) 2014-15 Sebastian Meyer (sparrow.242.de+eve@gmail.com )  #
+#																		  #
+#  This program is free software: you can redistribute it and/or modify	  #
+#  it under the terms of the GNU General Public License as published by	  #
+#  the Free Software Foundation, either version 3 of the License, or	  #
+#  (at your option) any later version.									  #
+#																		  #
+#  This program is distributed in the hope that it will be useful,		  #
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of		  #
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.	 See the		  #
+#  GNU General Public License for more details.							  #
+#																		  #
+#																		  #
+#  You should have received a copy of the GNU General Public License	  #
+#  along with this program.	 If not, see <http://www.gnu.org/licenses/>.  #
+###########################################################################
+
+import logging
+import threading
+
+from PyQt4 import QtCore
+from PyQt4.QtCore import SIGNAL
+from vi import dotlan
+from vi.cache.cache import Cache
+from vi.resources import resourcePath
+
+
+class BackfillThread(QtCore.QThread):
+    """ Reads the logs of the last day for a ChatParser, so the GUI does
+        not freeze meanwhile. Emits "backfill_done" with the parser and the
+        result, which must be given to ChatParser.apply_backfill in the
+        GUI thread.
+    """
+
+    def __init__(self, chatparser):
+        QtCore.QThread.__init__(self)
+        self.chatparser = chatparser
+
+    def run(self):
+        try:
+            results = self.chatparser.collect_backfill()
+        except Exception as e:
+            logging.error("Backfill failed: %s", e)
+            results = []
+        self.emit(SIGNAL("backfill_done"), self.chatparser, results)
+
+
+class MapLoaderThread(QtCore.QThread):
+    """ Builds the dotlan.Map of a region (reading the svg, maybe fetching it
+        from dotlan and processing it) without freezing the GUI. Emits
+        "map_loaded" with the region name, the map and None, or with None
+        and the DotlanException if there is no map.
+    """
+
+    def __init__(self, region_name):
+        QtCore.QThread.__init__(self)
+        self.regionName = region_name
+
+    def run(self):
+        svg = None
+        try:
+            with open(resourcePath("vi/ui/res/mapdata/{0}.svg".format(self.regionName))) as svgFile:
+                svg = svgFile.read()
+        except Exception:
+            pass
+        try:
+            dotlan_map = dotlan.Map(self.regionName, svg)
+        except dotlan.DotlanException as e:
+            self.emit(SIGNAL("map_loaded"), self.regionName, None, e)
+            return
+        self.emit(SIGNAL("map_loaded"), self.regionName, dotlan_map, None)
+
+
+class CacheSweeperThread(QtCore.QThread):
+    """ Runs Cache.sweep every interval seconds, the first time after one
+        interval. quit() stops it.
+    """
+
+    def __init__(self, interval=60 * 60):
+        QtCore.QThread.__init__(self)
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                Cache().sweep()
+            except Exception as e:
+                logging.error("Sweeping the cache failed: %s", e)
+
+    def quit(self):
+        self.stopped.set()
+        QtCore.QThread.quit(self)
@@ -22,6 +22,8 @@ import logging
 import sys
 import time
 import webbrowser
+from collections import OrderedDict
+from itertools import islice
 
 import requests
 import six
@@ -33,11 +35,14 @@ from PyQt4.QtGui import QAction
 from PyQt4.QtGui import QMessageBox
 from PyQt4.QtWebKit import QWebPage
 from vi import dotlan, filewatcher
+from vi.PanningWebView import PanningWebView
+from vi.RasterMapView import RasterMapView
 from vi import evegate
 from vi import states
 from vi.cache.cache import Cache
 from vi.chatparser import ChatParser
 from vi.resources import resourcePath
+from vi.threads import BackfillThread, CacheSweeperThread, MapLoaderThread
 from vi.ui.systemtray import TrayContextMenu
 
 # Timer intervals
@@ -45,6 +50,19 @@ MESSAGE_EXPIRY_SECS = 20 * 60
 MAP_UPDATE_INTERVAL_MSECS = 4 * 1000
 CLIPBOARD_CHECK_INTERVAL_MSECS = 4 * 1000
 
+# How many backfilled messages are applied between two runs of the event loop
+BACKFILL_BATCH_SIZE = 200
+
+# How many region maps are kept alive (with their intel) for switching back
+LIVE_MAPS = 3
+
+# How the map is shown until the user chooses (Window > Raster Map): "webkit" loads the svg into the
+# PanningWebView, "raster" renders the static map into cached tiles and paints the intel over it (see RasterMapView)
+MAP_RENDERER = "webkit"
+
+# Load the map document once and push the changes into it instead of replacing it on every update
+MAP_DIFFERENTIAL_UPDATES = True
+
 
 class MainWindow(QtGui.QMainWindow):
     def __init__(self, path_to_logs, tray_icon, back_ground_color):
@@ -55,6 +73,7 @@ class MainWindow(QtGui.QMainWindow):
         if back_ground_color:
             self.setStyleSheet("QWidget { background-color: %s; }" % back_ground_color)
         uic.loadUi(resourcePath('vi/ui/MainWindow.ui'), self)
+        self.mapRenderer = "webkit"  # the ui file has a PanningWebView, see change_map_renderer
         self.setWindowTitle("Vintel " + vi.version.VERSION + "{dev}".format(dev="-SNAPSHOT" if vi.version.SNAPSHOT else ""))
         self.taskbarIconQuiescent = QtGui.QIcon(resourcePath("vi/ui/res/logo_small.png"))
         self.taskbarIconWorking = QtGui.QIcon(resourcePath("vi/ui/res/logo_small_green.png"))
@@ -77,6 +96,19 @@ class MainWindow(QtGui.QMainWindow):
         self.scanIntelForKosRequestsEnabled = True
         self.initialMapPosition = None
         self.mapPositionsDict = {}
+        self.mapViewContent = None  # the map the document in mapView was loaded from
+        self.mapViewLoaded = False
+        self.dotlan = None  # the shown map, None until the first one is loaded
+        self.systems = {}
+        self.requestedRegion = None  # the region the map is loaded for
+        self.mapLoaderThreads = {}  # region name: the MapLoaderThread loading its map
+        self.backfillThread = None
+        self.backfillMessages = None  # the backfill while it is applied, see stream_backfill
+        self.backfillLocations = {}
+        self.backfillComplete = False
+        self.chatparser = None
+        self.liveMaps = OrderedDict()  # region name: dotlan.Map, the least recently shown first
+        self.mapsLeftAt = {}  # region name: eve time the map was hidden
 
         # Load user's toon names
         self.knownPlayerNames = self.cache.get_fromcache("known_player_names")
@@ -119,6 +151,7 @@ class MainWindow(QtGui.QMainWindow):
             pass
 
         self.wire_up_uiconnections()
+        self.change_map_renderer(MAP_RENDERER)
         self.recall_cached_settings()
         self.setup_threads()
         self.setup_map(True)
@@ -166,69 +199,97 @@ class MainWindow(QtGui.QMainWindow):
                      lambda: self.handle_region_menu_item_selected(self.providenceCatchCompactRegionAction))
         self.connect(self.chooseRegionAction, SIGNAL("triggered()"), self.show_region_chooser)
         self.connect(self.showChatAction, SIGNAL("triggered()"), self.change_chat_visibility)
+        self.connect(self.rasterMapAction, SIGNAL("triggered()"), self.change_map_renderer)
         self.connect(self.trayIcon, SIGNAL("alarm_distance"), self.change_alarm_distance)
         self.connect(self.framelessWindowAction, SIGNAL("triggered()"), self.change_frameless)
         self.connect(self.trayIcon, SIGNAL("change_frameless"), self.change_frameless)
         self.connect(self.frameButton, SIGNAL("clicked()"), self.change_frameless)
         self.connect(self.quitAction, SIGNAL("triggered()"), self.close)
         self.connect(self.trayIcon, SIGNAL("quit"), self.close)
-        self.mapView.page().scrollRequested.connect(self.map_position_changed)
+        self.wire_up_map_view()
+
+    def wire_up_map_view(self):
+        # Add a contextual menu to the mapView
+        def map_context_menu_event(event):
+            # if QApplication.activeWindow() or QApplication.focusWidget():
+            self.mapView.contextMenu.exec_(self.mapToGlobal(QPoint(event.x(), event.y())))
+
+        self.mapView.contextMenuEvent = map_context_menu_event
+        self.mapView.contextMenu = self.trayIcon.contextMenu()
+
+        # Clicking links
+        self.mapView.connect(self.mapView, SIGNAL("link_clicked(const QUrl&)"), self.map_link_clicked)
+        if self.mapRenderer == "raster":
+            self.connect(self.mapView, SIGNAL("scroll_changed"), self.map_position_changed)
+        else:
+            self.mapView.page().scrollRequested.connect(self.map_position_changed)
+            self.mapView.loadFinished.connect(self.map_view_loaded)
+
+    def change_map_renderer(self, renderer=None):
+        """ Shows the map with a RasterMapView ("raster") or a PanningWebView
+            ("webkit"), None takes it from the Raster Map menu entry
+        """
+        if renderer is None:
+            renderer = "raster" if self.rasterMapAction.isChecked() else "webkit"
+        self.rasterMapAction.setChecked(renderer == "raster")
+        if renderer == self.mapRenderer:
+            return
+        old_view = self.mapView
+        self.mapView = RasterMapView(self.mapwidget) if renderer == "raster" else PanningWebView(self.mapwidget)
+        self.mapView.setSizePolicy(old_view.sizePolicy())
+        self.mapView.setZoomFactor(old_view.zoomFactor())
+        index = self.verticalLayout.indexOf(old_view)
+        self.verticalLayout.removeWidget(old_view)
+        old_view.deleteLater()
+        self.verticalLayout.insertWidget(index, self.mapView)
+        self.mapRenderer = renderer
+        self.wire_up_map_view()
+
+        # The new view gets the whole map
+        self.mapViewContent = None
+        self.mapViewLoaded = False
+        if self.dotlan is not None:
+            self.set_initial_map_position_for_region(self.dotlan.region)
+            self.update_map_view()
 
     def setup_threads(self):
         # Set up threads and their connections
+        # All chats: KOS requests ("xxx ...") are taken from any room, not only the intel rooms
         self.filewatcherThread = filewatcher.FileWatcher(self.pathToLogs)
         self.connect(self.filewatcherThread, SIGNAL("file_change"), self.log_file_changed)
         self.filewatcherThread.start()
+        self.cacheSweeperThread = CacheSweeperThread()
+        self.cacheSweeperThread.start()
+
+        # The logs are read while the map loads, the parser gets the systems when the map is there
+        logging.critical("Creating chat parser")
+        self.chatparser = ChatParser(self.pathToLogs, self.roomnames, {})
+        self.backfillThread = BackfillThread(self.chatparser)
+        self.connect(self.backfillThread, SIGNAL("backfill_done"), self.backfill_done)
+        self.backfillThread.start()
 
     def setup_map(self, initialize=False):
+        """ Shows the map of the region in the cache, a map not alive is
+            loaded in a MapLoaderThread and shown by map_loaded
+        """
         self.mapTimer.stop()
+        # The shown map gets the whole backfill before it is left
+        self.stream_backfill(None)
         self.filewatcherThread.paused = True
 
         logging.info("Finding map file")
         region_name = self.cache.get_fromcache("region_name")
         if not region_name:
             region_name = "Providence"
-        svg = None
-        try:
-            with open(resourcePath("vi/ui/res/mapdata/{0}.svg".format(region_name))) as svgFile:
-                svg = svgFile.read()
-        except Exception as e:
-            pass
-
-        try:
-            self.dotlan = dotlan.Map(region_name, svg)
-        except dotlan.DotlanException as e:
-            logging.error(e)
-            QMessageBox.critical(None, "Error getting map", six.text_type(e), "Quit")
-            sys.exit(1)
-
-        if self.dotlan.outdatedCacheError:
-            e = self.dotlan.outdatedCacheError
-            diag_text = "Something went wrong getting map data. Proceeding with older cached data. " \
-                        "Check for a newer version and inform the maintainer.\n\nError: {0} {1}".format(type(e), six.text_type(e))
-            logging.warn(diag_text)
-            QMessageBox.warning(None, "Using map from cache", diag_text, "Ok")
-
-        self.systems = self.dotlan.systems
-        logging.critical("Creating chat parser")
-        self.chatparser = ChatParser(self.pathToLogs, self.roomnames, self.systems)
+        if self.dotlan is not None:
+            self.mapsLeftAt[self.dotlan.region] = evegate.current_eve_time()
+        self.requestedRegion = region_name
 
         # Menus - only once
         if initialize:
-            logging.critical("Initializing contextual menus")
-
-            # Add a contextual menu to the mapView
-            def map_context_menu_event(event):
-                # if QApplication.activeWindow() or QApplication.focusWidget():
-                self.mapView.contextMenu.exec_(self.mapToGlobal(QPoint(event.x(), event.y())))
-
-            self.mapView.contextMenuEvent = map_context_menu_event
-            self.mapView.contextMenu = self.trayIcon.contextMenu()
-
-            # Clicking links
-            self.mapView.connect(self.mapView, SIGNAL("link_clicked(const QUrl&)"), self.map_link_clicked)
+            logging.critical("Initializing the region menu")
 
-            # Also set up our app menus
+            # Set up our app menus
             if not region_name:
                 self.providenceCatchRegionAction.setChecked(True)
             elif region_name.startswith("Providencecatch"):
@@ -247,16 +308,116 @@ class MainWindow(QtGui.QMainWindow):
                 self.queriousRegionAction.setChecked(True)
             else:
                 self.chooseRegionAction.setChecked(True)
-        self.statisticsButton.setChecked(False)
+
+        if region_name in self.liveMaps:
+            logging.info("Using the live map of %s", region_name)
+            self.liveMaps[region_name] = self.liveMaps.pop(region_name)
+            self.show_map(region_name)
+        elif region_name not in self.mapLoaderThreads:
+            logging.critical("Loading the map of %s", region_name)
+            loader = MapLoaderThread(region_name)
+            self.connect(loader, SIGNAL("map_loaded"), self.map_loaded)
+            self.mapLoaderThreads[region_name] = loader
+            loader.start()
+
+    def map_loaded(self, region_name, dotlan_map, error):
+        """ A MapLoaderThread is done, shows its map if it is still the one wanted
+        """
+        self.mapLoaderThreads.pop(region_name).wait()
+        if region_name != self.requestedRegion:
+            logging.info("Dropping the map of %s, %s was chosen meanwhile", region_name, self.requestedRegion)
+            return
+        if error is not None:
+            logging.error(error)
+            QMessageBox.critical(None, "Error getting map", six.text_type(error), "Quit")
+            sys.exit(1)
+        self.liveMaps[region_name] = dotlan_map
+        while len(self.liveMaps) > LIVE_MAPS:
+            region, old_map = self.liveMaps.popitem(last=False)
+            self.mapsLeftAt.pop(region, None)
+        if dotlan_map.outdatedCacheError:
+            e = dotlan_map.outdatedCacheError
+            diag_text = "Something went wrong getting map data. Proceeding with older cached data. " \
+                        "Check for a newer version and inform the maintainer.\n\nError: {0} {1}".format(type(e), six.text_type(e))
+            logging.warn(diag_text)
+            QMessageBox.warning(None, "Using map from cache", diag_text, "Ok")
+        self.show_map(region_name)
+
+    def show_map(self, region_name):
+        """ Makes the live map of the region the shown one
+        """
+        self.dotlan = self.liveMaps[region_name]
+        self.systems = self.dotlan.systems
+        # The parser keeps what it read, the map catches up on what happened while it was not shown
+        self.chatparser.set_systems(self.systems, self.dotlan.systemResolver)
+        if self.backfillComplete:
+            self.prime_map(self.mapsLeftAt.get(region_name))
+        elif self.backfillMessages is not None:
+            QtCore.QTimer.singleShot(0, self.stream_backfill)
+        self.statisticsButton.setChecked(self.dotlan.statisticsVisible)
 
         # Update the new map view, then clear old statistics from the map and request new
         logging.critical("Updating the map")
-        self.update_map_view()
         self.set_initial_map_position_for_region(region_name)
+        self.update_map_view()
         self.mapTimer.start(MAP_UPDATE_INTERVAL_MSECS)
+        # The file watcher is allowed to run when the backfill is done (see stream_backfill)
+        if self.backfillComplete:
+            self.filewatcherThread.paused = False
+        logging.critical("Map setup complete")
+
+    def prime_map(self, since=None):
+        """ Sets the intel the parser knows (newer than since, eve time) and the
+            locations of the characters on the current map
+        """
+        for message in self.chatparser.known_intel(since):
+            alarm_time = evegate.eve_time_to_epoch(message.timestamp)
+            for system in message.systems:
+                system.set_status(message.status, alarm_time)
+        for char, location in self.chatparser.locations.items():
+            self.set_location(char, location["system"])
+
+    def backfill_done(self, chatparser, results):
+        """ The logs of the last day are read, they are applied to the map and
+            the chat in batches as soon as there is a map
+        """
+        logging.critical("Applying backfill")
+        self.backfillMessages = chatparser.apply_backfill(results)
+        if self.dotlan is not None:
+            QtCore.QTimer.singleShot(0, self.stream_backfill)
+
+    def stream_backfill(self, batch_size=BACKFILL_BATCH_SIZE):
+        """ Primes the map and the chat with the next batch_size (all if None) messages
+            of the backfill, and schedules itself again until the backfill is applied
+        """
+        if self.backfillMessages is None or self.dotlan is None:
+            return
+        now = time.time()
+        count = 0
+        for message in islice(self.backfillMessages, batch_size):
+            count += 1
+            if message.status == states.LOCATION:
+                self.knownPlayerNames.add(message.user)
+                self.backfillLocations[message.user] = message.systems[0]
+            elif message.status in (states.ALARM, states.CLEAR, states.REQUEST):
+                alarm_time = evegate.eve_time_to_epoch(message.timestamp)
+                if now - alarm_time < MESSAGE_EXPIRY_SECS:
+                    self.add_message_to_intel_chat(message)
+                for system in message.systems:
+                    system.set_status(message.status, alarm_time)
+        if batch_size is not None and count == batch_size:
+            self.update_map_view()
+            QtCore.QTimer.singleShot(0, self.stream_backfill)
+            return
+        self.backfillMessages = None
+        self.backfillComplete = True
+        for char, system in self.backfillLocations.items():
+            self.set_location(char, system)
+        self.backfillLocations = {}
+        self.update_map_view()
         # Allow the file watcher to run now that all else is set up
         self.filewatcherThread.paused = False
-        logging.critical("Map setup complete")
+        logging.critical("Backfill complete")
 
     def start_clipboard_timer(self):
         """
@@ -285,6 +446,7 @@ class MainWindow(QtGui.QMainWindow):
         settings = ((None, "restoreGeometry", str(self.saveGeometry())), (None, "restoreState", str(self.saveState())),
                     ("splitter", "restoreGeometry", str(self.splitter.saveGeometry())),
                     ("splitter", "restoreState", str(self.splitter.saveState())),
+                    (None, "change_map_renderer", self.mapRenderer),
                     ("mapView", "setZoomFactor", self.mapView.zoomFactor()),
                     (None, "change_chat_font_size", ChatEntryWidget.TEXT_SIZE),
                     (None, "change_opacity", self.opacityGroup.checkedAction().opacity),
@@ -300,6 +462,12 @@ class MainWindow(QtGui.QMainWindow):
 
         # Stop the threads
         try:
+            for loader in self.mapLoaderThreads.values():
+                loader.wait()
+            if self.backfillThread:
+                self.backfillThread.wait()
+            self.cacheSweeperThread.quit()
+            self.cacheSweeperThread.wait()
             self.avatarFindThread.quit()
             self.avatarFindThread.wait()
             self.filewatcherThread.quit()
@@ -312,6 +480,8 @@ class MainWindow(QtGui.QMainWindow):
             self.statisticsThread.wait()
         except Exception:
             pass
+        # Nothing put into the cache may be lost
+        Cache.flush()
         self.trayIcon.hide()
         event.accept()
 
@@ -386,6 +556,9 @@ class MainWindow(QtGui.QMainWindow):
         self.trayIcon.alarmDistance = distance
 
     def change_statistics_visibility(self):
+        if self.dotlan is None:
+            self.statisticsButton.setChecked(False)
+            return
         new_value = self.dotlan.change_statistics_visibility()
         self.statisticsButton.setChecked(new_value)
         self.update_map_view()
@@ -428,9 +601,10 @@ class MainWindow(QtGui.QMainWindow):
             system.remove_located_character(char)
         if not new_system == "?" and new_system in self.systems:
             self.systems[new_system].add_located_character(char)
-            self.set_map_content(self.dotlan.svg)
+            self.update_map_view()
 
     def set_map_content(self, content):
+        self.mapViewLoaded = False
         if self.initialMapPosition is None:
             scroll_position = self.mapView.page().mainFrame().scrollPosition()
         else:
@@ -458,10 +632,13 @@ class MainWindow(QtGui.QMainWindow):
         except Exception:
             pass
 
-    def map_position_changed(self, dx, dy, rect_to_scroll):
+    def map_position_changed(self, dx=0, dy=0, rect_to_scroll=None):
         region_name = self.cache.get_fromcache("region_name")
         if region_name:
-            scroll_position = self.mapView.page().mainFrame().scrollPosition()
+            if self.mapRenderer == "raster":
+                scroll_position = self.mapView.scrollPosition()
+            else:
+                scroll_position = self.mapView.page().mainFrame().scrollPosition()
             self.mapPositionsDict[region_name] = (scroll_position.x(), scroll_position.y())
 
     def show_chatroom_chooser(self):
@@ -564,9 +741,36 @@ class MainWindow(QtGui.QMainWindow):
             self.trayIcon.showMessage("Loading statstics failed", text, 3)
             logging.error("update_statistics_on_map, error: %s" % text)
 
+    def map_view_loaded(self, ok):
+        self.mapViewLoaded = ok
+        if ok:
+            # Apply the changes made while the document was loading
+            self.update_map_view()
+
     def update_map_view(self):
+        if self.dotlan is None:
+            return
         logging.debug("Updating map start")
-        self.set_map_content(self.dotlan.svg)
+        if self.mapRenderer == "raster":
+            if self.mapViewContent is self.dotlan:
+                self.mapView.apply_changes()
+            else:
+                self.mapViewContent = self.dotlan
+                self.mapView.set_map(self.dotlan)
+                if self.initialMapPosition is not None:
+                    self.mapView.setScrollPosition(self.initialMapPosition)
+                    self.initialMapPosition = None
+        elif MAP_DIFFERENTIAL_UPDATES and self.mapViewContent is self.dotlan:
+            # Changes made while the document is still loading are applied once it is loaded
+            if self.mapViewLoaded:
+                script = self.dotlan.update_script()
+                if script:
+                    self.mapView.page().mainFrame().evaluateJavaScript(script)
+        # Only replace the page content if the map actually changed
+        elif self.dotlan.update() or self.mapViewContent is not self.dotlan:
+            self.dotlan.discard_changes()
+            self.mapViewContent = self.dotlan
+            self.set_map_content(self.dotlan.svg)
         logging.debug("Updating map complete")
 
     def zoom_map_in(self):
@@ -608,7 +812,7 @@ class MainWindow(QtGui.QMainWindow):
                                 chars = nSystem.get_located_characters()
                                 if len(chars) > 0 and message.user not in chars:
                                     self.trayIcon.show_notification(message, system.name, ", ".join(chars), distance)
-                self.set_map_content(self.dotlan.svg)
+                self.update_map_view()
 
 
 class ChatroomsChooser(QtGui.QDialog):
@@ -88,6 +88,8 @@ class Application(QApplication):
         if not os.path.exists(vintel_directory):
             os.mkdir(vintel_directory)
         cache.Cache.PATH_TO_CACHE = os.path.join(vintel_directory, "cache-2.sqlite3")
+        # Writes are batched, the main window flushes them when it is closed
+        cache.Cache.WRITE_BEHIND = True
 
         vintel_log_directory = os.path.join(vintel_directory, "logs")
         if not os.path.exists(vintel_log_directory):